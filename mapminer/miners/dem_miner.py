@@ -1,8 +1,13 @@
+import os
+import warnings
+import requests
 import numpy as np
 import xarray as xr
 import rioxarray
 import pandas as pd
 import geopandas as gpd
+import dask
+import dask.array as dsa
 from shapely.geometry import Polygon, Point
 
 from pystac_client import Client
@@ -11,52 +16,255 @@ import planetary_computer
 
 class DEMMiner:
     """
-    A class to authenticate with Planetary Computer and fetch DEM data. If unavailable, it generates a dummy DEM.
+    A class to authenticate with Planetary Computer and fetch DEM data. A dummy DEM can be generated as an opt-in fallback.
     """
     
-    def __init__(self):
-        pass
+    def __init__(self, cache_dir=None):
+        """
+        Initializes the DEMMiner. The Planetary Computer catalog is opened on the first fetch and reused
+        by later ones.
+        
+        Args:
+            cache_dir (str): Optional directory where Copernicus DEM COGs are cached locally. Tiles are
+                             downloaded once and read from disk on later fetches (default: None, stream remotely).
+        """
+        self.authenticate()
+        self.catalog = None
+        self.cache_dir = cache_dir
     
     def authenticate(self):
         """
         Authenticates to Planetary Computer using the provided API key.
         """
         planetary_computer.settings.set_subscription_key("1d7ae9ea9d3843749757036a903ddb6c")
+
+    def _get_catalog(self):
+        """
+        Returns the Planetary Computer catalog, opening it on first use.
+        """
+        if self.catalog is None:
+            self.catalog = Client.open("https://planetarycomputer.microsoft.com/api/stac/v1", modifier=planetary_computer.sign_inplace)
+        return self.catalog
     
-    def fetch(self, lat=None, lon=None, radius=None, polygon=None):
+    def fetch(self, lat=None, lon=None, radius=None, polygon=None, resolution=30, fallback=False):
         """
-        Fetches DEM data from the Planetary Computer or generates a dummy DEM if the fetch fails.
+        Fetches DEM data from the Planetary Computer, loaded lazily straight onto the local UTM grid.
         
         Args:
-            polygon (Polygon): Input polygon for the area of interest.
-            crs (str): Coordinate reference system of the input polygon, defaults to 'epsg:4326'.
+            polygon (Polygon): Input polygon for the area of interest (EPSG:4326).
+            resolution (int): Output resolution in meters (default: 30).
+            fallback (bool): Return a zero-valued dummy DEM (with a warning) instead of raising when the
+                             fetch fails (default: False).
         
         Returns:
-            xr.DataArray: DEM data array or dummy DEM in case of failure.
+            xr.DataArray: DEM data array (float32, invalid values as NaN), or dummy DEM if fallback is used.
+
+        Raises:
+            ValueError: If no Copernicus DEM tiles cover the polygon.
         """
-        # Reproject polygon to WGS84 if not already in 'epsg:4326'
-        
         if polygon is None : 
             polygon = Point(lon,lat).buffer(radius/111/1000)
 
+        bbox = polygon.buffer(300 * (1 / 111 / 1000)).bounds
+        utm_crs = self._get_utm_crs(lat=polygon.centroid.y, lon=polygon.centroid.x)
+
         try:
-            # Query DEM data from Planetary Computer
-            planetary_catalog = Client.open("https://planetarycomputer.microsoft.com/api/stac/v1", modifier=planetary_computer.sign_inplace)
-            query = planetary_catalog.search(collections=["cop-dem-glo-30"], limit=100, bbox=polygon.buffer(300 * (1 / 111 / 1000)).bounds)
+            query = self._get_catalog().search(collections=["cop-dem-glo-30"], limit=100, bbox=bbox)
             query = list(query.items())
+            if len(query) == 0:
+                raise ValueError("No Copernicus DEM tiles found for the given polygon.")
+
+            if self.cache_dir is not None:
+                query = self._cache_tiles(query)
+
+            # Load directly onto the UTM grid, odc.stac reprojects chunk by chunk
+            ds_dem = load(
+                query,
+                bands=["data"],
+                bbox=bbox,
+                crs=utm_crs,
+                resolution=resolution,
+                chunks={}
+            )["data"].isel(time=0)
 
-            # Load DEM data using the specified bounds and reproject to UTM
-            ds_dem = load(query, bbox=polygon.buffer(300 * (1 / 111 / 1000)).bounds, chunks={}, crs="epsg:4326").astype("float32")["data"].rio.reproject(
-                self._get_utm_crs(lat=polygon.centroid.y, lon=polygon.centroid.x)).isel(time=0)
-            
-            # Replace invalid values (high values) with NaN
-            ds_dem.data[:] = np.where(ds_dem.data > 1e10, np.nan, ds_dem.data)
-        except:
-            # Generate dummy DEM in case of failure
-            ds_dem = self.get_dummy_dem(polygon)
+            # Mask nodata and invalid (high) values lazily
+            nodata = ds_dem.attrs.get("nodata")
+            ds_dem = ds_dem.astype("float32")
+            valid = ds_dem <= 1e10
+            if nodata is not None:
+                valid &= ds_dem != nodata
+            ds_dem = ds_dem.where(valid)
+        except Exception as e:
+            if not fallback:
+                raise
+            warnings.warn(f"DEM fetch failed ({e!r}), returning a zero-valued dummy DEM.")
+            ds_dem = self.get_dummy_dem(polygon, resolution=resolution)
 
         return ds_dem
+
+    def _cache_tiles(self, items):
+        """
+        Makes sure every DEM tile is available in `cache_dir` and points the items at the local copies.
+        
+        Args:
+            items (list): cop-dem-glo-30 STAC items.
+        
+        Returns:
+            list: Cloned STAC items whose 'data' asset href is the cached local COG.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        paths = dask.compute(*[self._cache_tile(item) for item in items], scheduler='threads')
+
+        cached = []
+        for item, path in zip(items, paths):
+            item = item.clone()
+            item.assets["data"].href = path
+            cached.append(item)
+        return cached
+
+    @dask.delayed
+    def _cache_tile(self, item):
+        """
+        Downloads a single DEM COG into `cache_dir` unless it is already cached.
+        
+        Args:
+            item (pystac.Item): cop-dem-glo-30 STAC item.
+        
+        Returns:
+            str: Path of the cached COG.
+        """
+        path = os.path.join(self.cache_dir, f"{item.id}.tif")
+        if os.path.exists(path):
+            return path
+
+        # Download to a temporary file first so a partial download never looks cached
+        tmp_path = f"{path}.{os.getpid()}.part"
+        with requests.get(item.assets["data"].href, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+        return path
     
+    def slope(self, ds_dem, resolution=None):
+        """
+        Computes slope (degrees) from a DEM lazily, chunk by chunk, using Horn's 3x3 method.
+        
+        Args:
+            ds_dem (xr.DataArray): DEM as returned by `fetch`.
+            resolution (float): Pixel size in meters. Defaults to the resolution of the DEM grid.
+        
+        Returns:
+            xr.DataArray: Slope in degrees (float32).
+        """
+        return self._terrain(ds_dem, self._slope_kernel, resolution, name="slope", units="degrees")
+
+    def aspect(self, ds_dem, resolution=None):
+        """
+        Computes aspect (degrees clockwise from north, direction the slope faces) from a DEM lazily.
+        Flat cells are NaN.
+        
+        Args:
+            ds_dem (xr.DataArray): DEM as returned by `fetch`.
+            resolution (float): Pixel size in meters. Defaults to the resolution of the DEM grid.
+        
+        Returns:
+            xr.DataArray: Aspect in degrees (float32).
+        """
+        return self._terrain(ds_dem, self._aspect_kernel, resolution, name="aspect", units="degrees")
+
+    def hillshade(self, ds_dem, azimuth=315.0, altitude=45.0, resolution=None):
+        """
+        Computes an analytical hillshade from a DEM lazily.
+        
+        Args:
+            ds_dem (xr.DataArray): DEM as returned by `fetch`.
+            azimuth (float): Sun azimuth in degrees clockwise from north (default: 315).
+            altitude (float): Sun altitude in degrees above the horizon (default: 45).
+            resolution (float): Pixel size in meters. Defaults to the resolution of the DEM grid.
+        
+        Returns:
+            xr.DataArray: Illumination in [0, 1] (float32).
+        """
+        return self._terrain(
+            ds_dem, self._hillshade_kernel, resolution, name="hillshade", units="1",
+            azimuth=azimuth, altitude=altitude
+        )
+
+    def _terrain(self, ds_dem, kernel, resolution=None, name=None, units=None, **kwargs):
+        """
+        Runs a 3x3 terrain kernel over the last two (y, x) dimensions with `map_overlap`, using a
+        one-pixel halo so results are seamless across chunk borders.
+        
+        Args:
+            ds_dem (xr.DataArray): DEM with y/x coordinates.
+            kernel (callable): Block function (z, dx, dy, **kwargs) -> array of the same shape.
+            resolution (float): Pixel size in meters. Defaults to the resolution of the DEM grid.
+            name (str): Name of the output DataArray.
+            units (str): Units attribute of the output.
+        
+        Returns:
+            xr.DataArray: Lazy terrain product on the DEM grid.
+        """
+        if resolution is None:
+            dx, dy = (abs(r) for r in ds_dem.rio.resolution())
+        else:
+            dx = dy = abs(resolution)
+
+        # Signed spacing along the array axes (y usually decreases on north-up grids)
+        if ds_dem.sizes['x'] > 1:
+            dx *= np.sign(ds_dem.x.values[1] - ds_dem.x.values[0])
+        if ds_dem.sizes['y'] > 1:
+            dy *= np.sign(ds_dem.y.values[1] - ds_dem.y.values[0])
+
+        data = dsa.asarray(ds_dem.data)
+        depth = {axis: 1 if axis >= data.ndim - 2 else 0 for axis in range(data.ndim)}
+        data = dsa.map_overlap(
+            kernel, data.astype("float32"), depth=depth, boundary="nearest",
+            dtype="float32", dx=dx, dy=dy, **kwargs
+        )
+
+        attrs = {k: v for k, v in ds_dem.attrs.items() if k not in ("nodata", "units", "description")}
+        attrs["units"] = units
+        return ds_dem.copy(data=data).rename(name).assign_attrs(attrs)
+
+    def _gradients(self, z, dx, dy):
+        """
+        Horn's 3x3 gradients (dz/d_east, dz/d_north) of a haloed block, padded back to the
+        block shape with NaN so `map_overlap` can trim the halo.
+        """
+        a, b, c = z[..., :-2, :-2], z[..., :-2, 1:-1], z[..., :-2, 2:]
+        d, f = z[..., 1:-1, :-2], z[..., 1:-1, 2:]
+        g, h, i = z[..., 2:, :-2], z[..., 2:, 1:-1], z[..., 2:, 2:]
+
+        dz_dx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * dx)
+        dz_dy = ((g + 2 * h + i) - (a + 2 * b + c)) / (8 * dy)
+
+        pad = [(0, 0)] * (z.ndim - 2) + [(1, 1), (1, 1)]
+        return (
+            np.pad(dz_dx, pad, constant_values=np.nan),
+            np.pad(dz_dy, pad, constant_values=np.nan),
+        )
+
+    def _slope_kernel(self, z, dx, dy):
+        dz_dx, dz_dy = self._gradients(z, dx, dy)
+        return np.degrees(np.arctan(np.hypot(dz_dx, dz_dy))).astype("float32")
+
+    def _aspect_kernel(self, z, dx, dy):
+        dz_dx, dz_dy = self._gradients(z, dx, dy)
+        # Downslope direction (-gradient) as a compass bearing
+        aspect = np.degrees(np.arctan2(-dz_dx, -dz_dy)) % 360
+        return np.where((dz_dx == 0) & (dz_dy == 0), np.nan, aspect).astype("float32")
+
+    def _hillshade_kernel(self, z, dx, dy, azimuth=315.0, altitude=45.0):
+        dz_dx, dz_dy = self._gradients(z, dx, dy)
+        zenith, azimuth = np.radians(90.0 - altitude), np.radians(azimuth)
+        slope = np.arctan(np.hypot(dz_dx, dz_dy))
+        aspect = np.arctan2(-dz_dx, -dz_dy)
+        shade = np.cos(zenith) * np.cos(slope) + np.sin(zenith) * np.sin(slope) * np.cos(azimuth - aspect)
+        return np.clip(shade, 0, 1).astype("float32")
+
     def _get_utm_crs(self, lat, lon):
         """
         Determines the appropriate UTM CRS based on the latitude and longitude.
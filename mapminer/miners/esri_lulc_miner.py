@@ -1,6 +1,8 @@
 import planetary_computer
 import pystac_client
 import dask
+import numpy as np
+import pandas as pd
 from odc.stac import load
 import xarray as xr
 from shapely.geometry import Polygon, Point, box
@@ -10,6 +12,19 @@ class ESRILULCMiner:
     """
     A class for fetching and processing the 10m Annual Land Use Land Cover (9-class) V2 from Microsoft's Planetary Computer.
     """
+    # Class codes of io-lulc-annual-v02 (0 is nodata)
+    classes = {
+        1: "Water",
+        2: "Trees",
+        4: "Flooded vegetation",
+        5: "Crops",
+        7: "Built area",
+        8: "Bare ground",
+        9: "Snow/ice",
+        10: "Clouds",
+        11: "Rangeland",
+    }
+    nodata = 0
     
     def __init__(self):
         """
@@ -19,7 +34,7 @@ class ESRILULCMiner:
         self.catalog_url = "https://planetarycomputer.microsoft.com/api/stac/v1"
         self.catalog = pystac_client.Client.open(self.catalog_url, modifier=planetary_computer.sign_inplace)
 
-    def fetch(self, lat=None, lon=None, radius=None, polygon=None, daterange="2024-01-01/2024-12-31"):
+    def fetch(self, lat=None, lon=None, radius=None, polygon=None, daterange="2024-01-01/2024-12-31", resolution=10, crs=None):
         """
         Fetches the 10m Annual Land Use Land Cover (9-class) for a given date range and bounding box or polygon.
         
@@ -28,10 +43,12 @@ class ESRILULCMiner:
         - lon (float): Longitude of the center point (if polygon is None).
         - radius (float): Radius around the center point in kilometers (if polygon is None).
         - polygon (shapely.geometry.Polygon): Polygon defining the area of interest (optional).
-        - daterange (str): Date range in 'YYYY-MM-DD/YYYY-MM-DD' format (default: 2021).
+        - daterange (str): Date range in 'YYYY-MM-DD/YYYY-MM-DD' format (default: 2024).
+        - resolution (float): Output resolution in meters (default: 10).
+        - crs (str): Output CRS (default: local UTM zone of the polygon centroid).
 
         Returns:
-        - xarray.Dataset: LULC imagery for the given area and date range.
+        - xarray.Dataset: uint8 categorical LULC cube (one time slice per year, 0 = nodata).
         """
         if polygon is None:
             # Create a polygon around the lat/lon with a given radius in kilometers
@@ -39,6 +56,8 @@ class ESRILULCMiner:
 
         # Convert the polygon to a bounding box
         bbox = polygon.bounds
+        if crs is None:
+            crs = self._get_utm_crs(lat=polygon.centroid.y, lon=polygon.centroid.x)
 
         # Search the Planetary Computer for LULC data
         query = self.catalog.search(
@@ -53,15 +72,126 @@ class ESRILULCMiner:
         if len(query_items) == 0:
             raise ValueError("No LULC data found for the given date range and bounding box.")
 
-        # Load the data using odc.stac and Dask for lazy loading
+        # Load the data using odc.stac and Dask for lazy loading, on a fixed grid and kept categorical
         ds_lulc = load(
             query_items,
             bbox=bbox,
+            crs=crs,
+            resolution=resolution,
+            resampling="nearest",
+            dtype="uint8",
+            nodata=self.nodata,
             chunks={}
-        ).astype("float32").sortby('time', ascending=True)
+        ).sortby('time', ascending=True)
+        ds_lulc.attrs['classes'] = dict(self.classes)
 
         return ds_lulc
 
+    def class_histogram(self, ds_lulc):
+        """
+        Counts pixels per LULC class for every year of the cube, chunk by chunk.
+        
+        Parameters:
+        - ds_lulc (xarray.Dataset | xarray.DataArray): Cube as returned by `fetch`.
+
+        Returns:
+        - pd.DataFrame: Pixel counts indexed by time, one column per class name.
+        """
+        da = self._as_array(ds_lulc)
+        counts = dask.compute(*[self._bincount(da.isel(time=t).data) for t in range(da.sizes['time'])])
+
+        codes = list(self.classes)
+        return pd.DataFrame(
+            [c[codes] for c in counts],
+            index=pd.Index(da.time.values, name="time"),
+            columns=[self.classes[c] for c in codes],
+        )
+
+    def class_area(self, ds_lulc):
+        """
+        Computes the area per LULC class for every year of the cube.
+        
+        Parameters:
+        - ds_lulc (xarray.Dataset | xarray.DataArray): Cube as returned by `fetch`.
+
+        Returns:
+        - pd.DataFrame: Area in square kilometers indexed by time, one column per class name.
+        """
+        res_x, res_y = self._as_array(ds_lulc).rio.resolution()
+        return self.class_histogram(ds_lulc) * abs(res_x * res_y) / 1e6
+
+    def transition_matrix(self, ds_lulc, start=0, end=-1):
+        """
+        Builds the class transition matrix between two years of the cube, chunk by chunk.
+        
+        Parameters:
+        - ds_lulc (xarray.Dataset | xarray.DataArray): Cube as returned by `fetch`.
+        - start (int): Index of the 'from' time slice (default: first year).
+        - end (int): Index of the 'to' time slice (default: last year).
+
+        Returns:
+        - pd.DataFrame: Pixel counts, rows are 'from' classes and columns are 'to' classes.
+        """
+        da = self._as_array(ds_lulc)
+        before, after = da.isel(time=start).data, da.isel(time=end).data
+
+        # One bincount over the pair code (from * 256 + to) per block
+        pairs = before.astype("uint16") * 256 + after.rechunk(before.chunks).astype("uint16")
+        counts = self._bincount(pairs, minlength=256 * 256).compute().reshape(256, 256)
+
+        codes = list(self.classes)
+        names = [self.classes[c] for c in codes]
+        return pd.DataFrame(
+            counts[np.ix_(codes, codes)],
+            index=pd.Index(names, name=str(da.time.values[start])[:10]),
+            columns=pd.Index(names, name=str(da.time.values[end])[:10]),
+        )
+
+    def _as_array(self, ds_lulc):
+        """
+        Returns the single LULC band of a Dataset (or the DataArray itself).
+        """
+        if isinstance(ds_lulc, xr.Dataset):
+            return ds_lulc[list(ds_lulc.data_vars)[0]]
+        return ds_lulc
+
+    def _bincount(self, data, minlength=256):
+        """
+        Lazy `np.bincount` over a dask array: one bincount per block, summed at the end.
+
+        Parameters:
+        - data (dask.array.Array): Integer array.
+        - minlength (int): Number of bins.
+
+        Returns:
+        - dask.delayed.Delayed: int64 counts of length `minlength`.
+        """
+        counts = [
+            dask.delayed(lambda block: np.bincount(block.ravel(), minlength=minlength))(block)
+            for block in data.to_delayed().ravel()
+        ]
+        return dask.delayed(np.sum)(counts, axis=0)
+
+    def _get_utm_crs(self, lat, lon):
+        """
+        Determines the appropriate UTM CRS based on the latitude and longitude.
+        
+        Parameters:
+        - lat (float): Latitude of the location.
+        - lon (float): Longitude of the location.
+        
+        Returns:
+        - str: The EPSG code for the local UTM CRS.
+        """
+        # Calculate the UTM zone based on longitude
+        utm_zone = int((lon + 180) // 6) + 1
+        
+        # Determine the EPSG code for the northern or southern hemisphere
+        if lat >= 0:
+            return f"EPSG:326{utm_zone:02d}"  # Northern hemisphere UTM (EPSG:326XX)
+        else:
+            return f"EPSG:327{utm_zone:02d}"  # Southern hemisphere UTM (EPSG:327XX)
+
 # Example usage:
 if __name__ == "__main__":
     lulc_miner = ESRILULCMiner()
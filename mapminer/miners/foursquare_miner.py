@@ -1,95 +1,382 @@
+import os
+import json
+import time
+import threading
 import duckdb
 import fsspec
 import geopandas as gpd
 import numpy as np
 import pandas as pd
+import shapely
 from shapely.geometry import Point
-from shapely import wkt
 import dask.dataframe as dd
-from dask.diagnostics import ProgressBar
 
 
 class FourSquareMiner:
-    def __init__(self, engine='duckdb'):
+    # DuckDB connection and release listing shared by all miners of the process
+    _con = None
+    _con_lock = threading.Lock()
+    _releases = None
+    _releases_lock = threading.Lock()
+    _base32 = np.array(list('0123456789bcdefghjkmnpqrstuvwxyz'))
+
+    def __init__(self, engine='duckdb', release_ttl=24*3600, mirror_dir=None, geohash_precision=4):
         """
         Initialize the FourSquareMiner with the specified engine.
+        The S3 release listing is cached for release_ttl seconds. With mirror_dir, regions copied
+        by `mirror` are kept as local parquet partitioned by geohash prefixes of geohash_precision
+        characters, and fetches they fully cover are answered from disk.
         """
         self.engine = engine
+        self.release_ttl = release_ttl
+        self.mirror_dir = mirror_dir
+        self.geohash_precision = geohash_precision
         self.parquet_path = 's3://fsq-os-places-us-east-1/release/dt=2024-11-19/places/parquet/'
+        self._local = threading.local()
         if engine == 'duckdb':
             self._setup_duckdb()
 
     def _setup_duckdb(self):
         """
-        Set up the DuckDB connection and configure S3 and spatial extensions.
+        Set up the shared DuckDB connection once per process: load the S3 and spatial extensions
+        (installing them only when missing) and enable the HTTP metadata and parquet metadata caches,
+        so footers and file listings are reused across queries.
+        """
+        with FourSquareMiner._con_lock:
+            if FourSquareMiner._con is not None:
+                return
+            con = duckdb.connect()
+            for extension in ('httpfs', 'spatial'):
+                try:
+                    con.execute(f"LOAD {extension};")
+                except duckdb.Error:
+                    con.execute(f"INSTALL {extension};")
+                    con.execute(f"LOAD {extension};")
+            con.execute("SET GLOBAL s3_region='us-east-1';")
+            con.execute("SET GLOBAL enable_http_metadata_cache=true;")
+            # Parquet footers are cached by enable_object_cache up to DuckDB 1.1 and by
+            # parquet_metadata_cache since 1.2, where the former became a no-op
+            for setting in ('enable_object_cache', 'parquet_metadata_cache'):
+                try:
+                    con.execute(f"SET GLOBAL {setting}=true;")
+                except duckdb.Error:
+                    pass
+            FourSquareMiner._con = con
+
+    def _cursor(self):
+        """
+        DuckDB cursor of the calling thread on the shared connection. Cursors share the database
+        instance and its caches, but are safe to use concurrently from different threads.
         """
-        self.con = duckdb.connect()
-        self.con.execute("INSTALL httpfs;")
-        self.con.execute("LOAD httpfs;")
-        self.con.execute("INSTALL spatial;")
-        self.con.execute("LOAD spatial;")
-        self.con.execute("SET s3_region='us-east-1';")
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self._local.cursor = FourSquareMiner._con.cursor()
+        return cursor
 
     def _fetch_duckdb(self, polygon):
         """
-        Fetch data using DuckDB and filter using a spatial polygon.
+        Fetch data using DuckDB and filter using a spatial polygon, with the points also as WKT in
+        'wkt_geometry'. Plain bbox predicates on latitude/longitude come first so parquet row groups are pruned
+        by their min/max statistics, and the exact polygon test only runs on the survivors.
         """
+        minx, miny, maxx, maxy = polygon.bounds
         query = f"""
-        SELECT *,
-               ST_AsText(ST_Point(longitude, latitude)) AS wkt_geometry
+        SELECT *
         FROM read_parquet('{self.parquet_path}*.parquet')
-        WHERE ST_Within(ST_Point(longitude, latitude), ST_GeomFromText('{polygon.wkt}'))
+        WHERE longitude BETWEEN ? AND ?
+          AND latitude BETWEEN ? AND ?
+          AND ST_Within(ST_Point(longitude, latitude), ST_GeomFromText(?))
+        """
+        result_df = self._cursor().execute(query, [minx, maxx, miny, maxy, polygon.wkt]).fetch_arrow_table().to_pandas()
+        geometry = gpd.points_from_xy(result_df['longitude'], result_df['latitude'], crs='EPSG:4326')
+        result_df['wkt_geometry'] = self._wkt(geometry)
+        return gpd.GeoDataFrame(result_df, geometry=geometry)
+
+    def _wkt(self, geometry):
+        """
+        Full-precision WKT of the place points, returned as 'wkt_geometry' by the DuckDB engine.
         """
-        result_df = self.con.execute(query).fetchdf()
-        result_df['geometry'] = result_df['wkt_geometry'].apply(wkt.loads)
-        gdf = gpd.GeoDataFrame(result_df, geometry='geometry')
-        gdf.set_crs(epsg=4326, inplace=True)
-        return gdf
+        return shapely.to_wkt(np.asarray(geometry), rounding_precision=-1)
 
     def _fetch_dask(self, polygon):
         """
-        Fetch data using Dask and filter using bounding box of the polygon.
+        Fetch data using Dask and filter using a spatial polygon.
+        The bbox is pushed into the parquet read as filters, and each partition builds its points
+        with points_from_xy and keeps those within the polygon in one vectorized predicate.
         """
-        ddf = dd.read_parquet(self.parquet_path, storage_options={"anon": True})
         minx, miny, maxx, maxy = polygon.bounds
-        ddf_filtered = ddf[(ddf['latitude'] >= miny) & (ddf['latitude'] <= maxy) &
-                           (ddf['longitude'] >= minx) & (ddf['longitude'] <= maxx)]
-        
-        # Apply point creation
-        def make_point(row):
-            return Point(row['longitude'], row['latitude'])
-        
-        meta = ddf_filtered.head(0)
-        meta['geometry'] = gpd.GeoSeries([Point()])
-        ddf_filtered['geometry'] = ddf_filtered.apply(make_point, axis=1, meta=('geometry', 'object'))
-        dgdf = ddf_filtered.map_partitions(gpd.GeoDataFrame, geometry='geometry', crs='EPSG:4326', meta=meta)
-        
-        with ProgressBar():
-            dgdf = dgdf.compute()
-        
-        return dgdf
+        filters = [('longitude', '>=', minx), ('longitude', '<=', maxx), ('latitude', '>=', miny), ('latitude', '<=', maxy)]
+        ddf = dd.read_parquet(self.parquet_path, filters=filters, storage_options={"anon": True})
+
+        def within_polygon(df):
+            df = df[df['longitude'].between(minx, maxx) & df['latitude'].between(miny, maxy)]
+            geometry = gpd.points_from_xy(df['longitude'], df['latitude'], crs='EPSG:4326')
+            inside = shapely.within(geometry, polygon)
+            return gpd.GeoDataFrame(df[inside], geometry=geometry[inside])
+
+        gdf = ddf.map_partitions(within_polygon, meta=within_polygon(ddf._meta)).compute()
+        return gpd.GeoDataFrame(gdf, geometry='geometry', crs='EPSG:4326')
+
+    def fetch_many(self, gdf, daterange="2024-11-19", max_cells=256):
+        """
+        Fetch the places within each polygon of a GeoDataFrame in a single scan of the release.
+        The polygons are loaded into DuckDB once as geometries, along with the grid cells their
+        bboxes cover. Places are pruned to the overall bbox, hash-joined to the polygons on their
+        grid cell, prefiltered on the polygon bbox and tested exactly with ST_Within. Polygons
+        covering more than max_cells grid cells go through `fetch` one by one instead.
+        Returns the places tagged with the index label of their polygon in 'polygon_index', with the
+        same columns as `fetch`.
+        """
+        daterange = daterange.split("/")[-1]
+        if gdf.crs is not None:
+            gdf = gdf.to_crs(epsg=4326)
+        bounds = gdf.geometry.bounds.to_numpy()
+
+        # Grid of about the typical polygon size, every polygon listed under each cell its bbox touches
+        extent = np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])
+        cell = float(max(np.median(extent), 1e-3)) if len(gdf) else 1.0
+        x0, y0 = np.floor(bounds[:, 0] / cell).astype(np.int64), np.floor(bounds[:, 1] / cell).astype(np.int64)
+        width = np.floor(bounds[:, 2] / cell).astype(np.int64) - x0 + 1
+        counts = width * (np.floor(bounds[:, 3] / cell).astype(np.int64) - y0 + 1)
+
+        # Outliers much larger than the grid would explode into cells
+        outliers = np.flatnonzero(counts > max_cells)
+        batch = np.flatnonzero(counts <= max_cells)
+        x0, y0, width, counts = x0[batch], y0[batch], width[batch], counts[batch]
+
+        polygons = pd.DataFrame({
+            'polygon_id': batch,
+            'wkt': shapely.to_wkt(gdf.geometry.values[batch]),
+            'minx': bounds[batch, 0], 'miny': bounds[batch, 1], 'maxx': bounds[batch, 2], 'maxy': bounds[batch, 3],
+        })
+        step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = pd.DataFrame({
+            'polygon_id': np.repeat(batch, counts),
+            'cx': np.repeat(x0, counts) + step % np.repeat(width, counts),
+            'cy': np.repeat(y0, counts) + step // np.repeat(width, counts),
+        })
+
+        self.parquet_path = self._get_parquet_path(daterange)
+        self._setup_duckdb()
+        cursor = self._cursor()
+        cursor.register('fetch_many_wkt', polygons)
+        cursor.register('fetch_many_cells', cells)
+        try:
+            # Parse every polygon once, not once per candidate place
+            cursor.execute("""
+            CREATE OR REPLACE TEMP TABLE fetch_many_polygons AS
+            SELECT polygon_id, ST_GeomFromText(wkt) AS geom, minx, miny, maxx, maxy
+            FROM fetch_many_wkt
+            """)
+            query = f"""
+            WITH places AS (
+                SELECT *, floor(longitude / ?)::BIGINT AS _cx, floor(latitude / ?)::BIGINT AS _cy
+                FROM read_parquet('{self.parquet_path}*.parquet')
+                WHERE longitude BETWEEN ? AND ?
+                  AND latitude BETWEEN ? AND ?
+            ),
+            candidates AS (
+                SELECT places.*, cells.polygon_id
+                FROM places
+                JOIN fetch_many_cells AS cells ON places._cx = cells.cx AND places._cy = cells.cy
+            )
+            SELECT candidates.* EXCLUDE (_cx, _cy)
+            FROM candidates
+            JOIN fetch_many_polygons AS polygons ON candidates.polygon_id = polygons.polygon_id
+            WHERE candidates.longitude BETWEEN polygons.minx AND polygons.maxx
+              AND candidates.latitude BETWEEN polygons.miny AND polygons.maxy
+              AND ST_Within(ST_Point(candidates.longitude, candidates.latitude), polygons.geom)
+            """
+            overall = [bounds[batch, 0].min(), bounds[batch, 2].max(), bounds[batch, 1].min(), bounds[batch, 3].max()] if len(batch) else [0, -1, 0, -1]
+            parameters = [cell, cell] + [float(value) for value in overall]
+            result_df = cursor.execute(query, parameters).fetch_arrow_table().to_pandas()
+        finally:
+            cursor.execute("DROP TABLE IF EXISTS fetch_many_polygons")
+            cursor.unregister('fetch_many_wkt')
+            cursor.unregister('fetch_many_cells')
+
+        polygon_id = result_df.pop('polygon_id').to_numpy(dtype=np.int64)
+        geometry = gpd.points_from_xy(result_df['longitude'], result_df['latitude'], crs='EPSG:4326')
+        if self.engine == 'duckdb':
+            result_df['wkt_geometry'] = self._wkt(geometry)
+        result_df['polygon_index'] = gdf.index.values[polygon_id]
+        results = [gpd.GeoDataFrame(result_df, geometry=geometry)]
+
+        for i in outliers:
+            places = self.fetch(polygon=gdf.geometry.values[i], daterange=daterange)
+            places.insert(len(places.columns) - 1, 'polygon_index', gdf.index.values[i])
+            results.append(places)
+        return pd.concat(results, ignore_index=True) if len(results) > 1 else results[0]
 
     def _get_parquet_path(self, daterange):
         """
         Update the parquet path based on the closest available date.
         """
-        fs = fsspec.filesystem('s3', anon=True)
-        s3_directory = 's3://fsq-os-places-us-east-1/release/'
-        files = fs.ls(s3_directory)
+        files = self._list_releases()
         file_dates = [pd.to_datetime(f.split("dt=")[1]) for f in files]
         closest_file = files[np.argmin(abs(pd.to_datetime(daterange) - pd.to_datetime(file_dates)))]
         return f's3://{closest_file}/places/parquet/'
 
+    def _list_releases(self):
+        """
+        List the release prefixes on S3, cached for release_ttl seconds. With a mirror_dir the
+        listing is also saved there, and the last known listing is used when S3 is unreachable.
+        """
+        listing_path = os.path.join(self.mirror_dir, "releases.json") if self.mirror_dir is not None else None
+        with FourSquareMiner._releases_lock:
+            if FourSquareMiner._releases is None or time.time() - FourSquareMiner._releases[0] > self.release_ttl:
+                try:
+                    fs = fsspec.filesystem('s3', anon=True)
+                    s3_directory = 's3://fsq-os-places-us-east-1/release/'
+                    FourSquareMiner._releases = (time.time(), fs.ls(s3_directory))
+                except Exception:
+                    # Offline: keep the stale listing, or the one saved with the mirror
+                    if FourSquareMiner._releases is not None:
+                        return FourSquareMiner._releases[1]
+                    if listing_path is None or not os.path.exists(listing_path):
+                        raise
+                    with open(listing_path, 'r') as f:
+                        return json.load(f)
+
+                if listing_path is not None:
+                    os.makedirs(self.mirror_dir, exist_ok=True)
+                    tmp_path = f"{listing_path}.{os.getpid()}.part"
+                    with open(tmp_path, 'w') as f:
+                        json.dump(FourSquareMiner._releases[1], f)
+                    os.replace(tmp_path, listing_path)
+            return FourSquareMiner._releases[1]
+
+    def _geohash_cells(self, lon, lat, precision):
+        """
+        Integer column/row of the geohash cells containing lon/lat positions.
+        """
+        lon_bits, lat_bits = (5 * precision + 1) // 2, 5 * precision // 2
+        x = np.clip(((np.asarray(lon, dtype=np.float64) + 180) / 360 * 2 ** lon_bits).astype(np.int64), 0, 2 ** lon_bits - 1)
+        y = np.clip(((np.asarray(lat, dtype=np.float64) + 90) / 180 * 2 ** lat_bits).astype(np.int64), 0, 2 ** lat_bits - 1)
+        return x, y
+
+    def _geohash_codes(self, x, y, precision):
+        """
+        Interleave geohash cell columns/rows into integer geohash codes (longitude bits first).
+        Codes sort in geohash order.
+        """
+        lon_bits, lat_bits = (5 * precision + 1) // 2, 5 * precision // 2
+        code = np.zeros(np.shape(x), dtype=np.int64)
+        for bit in range(5 * precision):
+            source, shift = (x, lon_bits - 1 - bit // 2) if bit % 2 == 0 else (y, lat_bits - 1 - bit // 2)
+            code = (code << 1) | ((source >> shift) & 1)
+        return code
+
+    def _geohash_strings(self, codes, precision):
+        """
+        Base32 geohash strings of integer geohash codes.
+        """
+        digits = np.stack([(np.asarray(codes) >> (5 * (precision - 1 - k))) & 31 for k in range(precision)], axis=-1)
+        return [''.join(chars) for chars in self._base32[digits].reshape(-1, precision)]
+
+    def _covering_geohashes(self, bounds):
+        """
+        Geohash prefixes of the partitions covering a bbox, and the bbox of their union.
+        """
+        precision = self.geohash_precision
+        lon_bits, lat_bits = (5 * precision + 1) // 2, 5 * precision // 2
+        (x0, x1), (y0, y1) = self._geohash_cells([bounds[0], bounds[2]], [bounds[1], bounds[3]], precision)
+        x, y = np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1))
+        prefixes = self._geohash_strings(self._geohash_codes(x.ravel(), y.ravel(), precision), precision)
+        width, height = 360 / 2 ** lon_bits, 180 / 2 ** lat_bits
+        return prefixes, (x0 * width - 180, y0 * height - 90, (x1 + 1) * width - 180, (y1 + 1) * height - 90)
+
+    def _mirror_path(self, release, prefix):
+        """
+        Path of a local partition of a release.
+        """
+        return os.path.join(self.mirror_dir, release, f"geohash={prefix}", "part.parquet")
+
+    def mirror(self, lat=None, lon=None, radius=None, polygon=None, bbox=None, daterange="2024-11-19"):
+        """
+        Copy the places of a region into the local mirror. The region is widened to whole geohash
+        cells, every covering cell is written as its own partition (empty ones included, so they
+        count as mirrored), and rows are sorted by full precision geohash within partitions.
+
+        Returns the paths of the written partitions.
+        """
+        if self.mirror_dir is None:
+            raise ValueError("mirror_dir is required to mirror places.")
+        daterange = daterange.split("/")[-1]
+        if bbox is None:
+            if polygon is None:
+                polygon = Point(lon, lat).buffer(radius / 111 / 1000)  # Approx. 1 degree = 111 km
+            bbox = polygon.bounds
+
+        parquet_path = self._get_parquet_path(daterange)
+        release = parquet_path.split('/')[-4]
+        prefixes, (minx, miny, maxx, maxy) = self._covering_geohashes(bbox)
+
+        self._setup_duckdb()
+        query = f"""
+        SELECT *
+        FROM read_parquet('{parquet_path}*.parquet')
+        WHERE longitude >= ? AND longitude < ?
+          AND latitude >= ? AND latitude < ?
+        """
+        df = self._cursor().execute(query, [minx, maxx, miny, maxy]).fetch_arrow_table().to_pandas()
+
+        # Full precision geohash order inside partitions, partition prefix from its leading characters
+        codes = self._geohash_codes(*self._geohash_cells(df['longitude'], df['latitude'], 12), 12)
+        order = np.argsort(codes, kind='stable')
+        df, codes = df.iloc[order].reset_index(drop=True), codes[order]
+        partition = codes >> (5 * (12 - self.geohash_precision))
+        keys = dict(zip(self._geohash_strings(np.unique(partition), self.geohash_precision), np.unique(partition)))
+
+        paths = []
+        for prefix in prefixes:
+            path = self._mirror_path(release, prefix)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            rows = df[partition == keys[prefix]] if prefix in keys else df.iloc[:0]
+            tmp_path = f"{path}.{os.getpid()}.part"
+            rows.to_parquet(tmp_path, index=False, row_group_size=10000)
+            os.replace(tmp_path, path)
+            paths.append(path)
+        return paths
+
+    def _fetch_mirror(self, polygon, parquet_path):
+        """
+        Answer a fetch from the local mirror of the release at parquet_path, so a mirror of an
+        older release never stands in for the one the remote path would read.
+        Returns None when a partition covering the polygon has not been mirrored.
+        """
+        if self.mirror_dir is None:
+            return None
+        release = parquet_path.split('/')[-4]
+
+        prefixes, _ = self._covering_geohashes(polygon.bounds)
+        paths = [self._mirror_path(release, prefix) for prefix in prefixes]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+
+        minx, miny, maxx, maxy = polygon.bounds
+        filters = [('longitude', '>=', minx), ('longitude', '<=', maxx), ('latitude', '>=', miny), ('latitude', '<=', maxy)]
+        df = pd.concat([pd.read_parquet(path, filters=filters) for path in paths], ignore_index=True)
+        geometry = gpd.points_from_xy(df['longitude'], df['latitude'], crs='EPSG:4326')
+        inside = shapely.within(geometry, polygon)
+        df = df[inside].reset_index(drop=True)
+        if self.engine == 'duckdb':
+            df['wkt_geometry'] = self._wkt(geometry[inside])
+        return gpd.GeoDataFrame(df, geometry=geometry[inside])
+
     def fetch(self, lat=None, lon=None, radius=None, polygon=None, daterange="2024-11-19"):
         """
         Fetch data based on input location (lat, lon) and radius or a polygon.
-        Supports fetching by DuckDB or Dask engine.
+        Supports fetching by DuckDB or Dask engine, or from the local mirror when it covers the polygon.
         """
         daterange = daterange.split("/")[-1]
         if polygon is None:
             polygon = Point(lon, lat).buffer(radius / 111 / 1000)  # Approx. 1 degree = 111 km
-        
+
         self.parquet_path = self._get_parquet_path(daterange)
+        gdf = self._fetch_mirror(polygon, self.parquet_path)
+        if gdf is not None:
+            return gdf
 
         if self.engine == 'duckdb':
             return self._fetch_duckdb(polygon)
@@ -1,26 +1,52 @@
 import ee
 import os
+import io
 import json
+import requests
 import numpy as np
 import pandas as pd
 import rioxarray
 import geopandas as gpd
 from shapely.geometry import Polygon, Point
+import shapely
 import dask
+import threading
 from cryptography.fernet import Fernet
 
+from ..utils import morton_key
+
 class GoogleBuildingMiner:
     """
     GoogleMiner class for extracting building data from Google Open Buildings dataset using Google Earth Engine (GEE).
     """
 
-    def __init__(self, json_path: str=None):
+    collection = "GOOGLE/Research/open-buildings/v3/polygons"
+
+    def __init__(self, json_path: str=None, cache_dir: str=None, max_level: int=18, bulk: bool=False, download_workers: int=8,
+                 store_dir: str=None, store_level: int=10):
         """
         Initializes GoogleMiner by authenticating using the provided JSON key file.
         
         Args:
             json_path (str): Path to the service account JSON file.
+            cache_dir (str): Optional directory where building counts of quadtree cells are cached,
+                             so repeated and overlapping AOIs skip the splitting round trips.
+            max_level (int): Deepest quadtree level used when splitting polygons.
+            bulk (bool): Download each part as a CSV table export instead of `getInfo` GeoJSON, which lifts
+                         the 5000 features per request cap and allows much larger parts.
+            download_workers (int): Maximum number of table downloads running at once in bulk mode.
+            store_dir (str): Optional directory of a local GeoParquet building store filled by `mirror`.
+                             AOIs whose cells are all mirrored are answered from disk.
+            store_level (int): Quadtree level of the store partitions (one file per cell).
         """
+        self.store_dir = store_dir
+        self.store_level = store_level
+        self.bulk = bulk
+        self.download_workers = download_workers
+        self.cache_dir = cache_dir
+        self.max_level = max_level
+        self.counts = None
+        self.counts_lock = threading.Lock()
         self.authenticate(json_path)
     
     def fetch(self,lat=None,lon=None,radius=None,polygon=None):
@@ -36,12 +62,36 @@ class GoogleBuildingMiner:
         """
         if polygon is None : 
             polygon = Point(lon,lat).buffer(radius/111/1000)
+
+        # Answer from the local store when it covers the polygon
+        if self.store_dir is not None:
+            df_building = self.fetch_store(polygon)
+            if df_building is not None:
+                return df_building
+
+        return self.fetch_remote(polygon)
+
+    def fetch_remote(self, polygon: Polygon) -> gpd.GeoDataFrame:
+        """
+        Fetches building data for the given polygon from Earth Engine.
         
+        Args:
+            polygon (shapely.geometry.Polygon): Input polygon EPSG:4326.
+
+        Returns:
+            gpd.GeoDataFrame: GeoDataFrame with building information.
+        """
         # Split polygon into smaller parts for efficient processing
-        filtered_polygons = self.split_polygon(polygon, max_counts=5000)
+        if self.bulk:
+            filtered_polygons = self.split_polygon(polygon, max_counts=100000)
+            tasks = [self.download_buildings(polygon) for polygon in filtered_polygons]
+            results = dask.compute(*tasks, scheduler='threads', num_workers=self.download_workers)
+        else:
+            filtered_polygons = self.split_polygon(polygon, max_counts=5000)
+            results = dask.compute(*[self.fetch_buildings(polygon) for polygon in filtered_polygons])
 
         # Fetch building data for all the split polygons using Dask
-        df_building = pd.concat(dask.compute(*[self.fetch_buildings(polygon) for polygon in filtered_polygons]), axis=0)
+        df_building = pd.concat(results, axis=0) if results else []
         if len(df_building)==0: 
             df_building = gpd.GeoDataFrame(pd.DataFrame(columns=["layer_id","geometry"]), geometry="geometry").set_crs('epsg:4326')
             
@@ -100,67 +150,238 @@ class GoogleBuildingMiner:
         return gpd.GeoDataFrame.from_features(features)
     
     @dask.delayed
-    def fetch_counts(self, polygon: Polygon) -> int:
+    def download_buildings(self, polygon: Polygon) -> gpd.GeoDataFrame:
         """
-        Fetches the count of building features lazily for a given polygon.
+        Downloads building features lazily for a given polygon through an Earth Engine table download
+        URL. Geometries arrive as GeoJSON strings in the '.geo' column of the CSV and are decoded in
+        one vectorized call.
         
         Args:
             polygon (shapely.geometry.Polygon): Input polygon.
 
         Returns:
-            int: Count of buildings within the polygon.
+            gpd.GeoDataFrame: GeoDataFrame with building features.
+        """
+        url = ee.FeatureCollection(self.collection).filterBounds(ee.Geometry(polygon.__geo_interface__)).getDownloadURL(
+            filetype='csv', selectors=['area_in_meters', 'confidence', 'full_plus_code', '.geo'])
+        response = requests.get(url, timeout=600)
+        response.raise_for_status()
+
+        df = pd.read_csv(io.BytesIO(response.content))
+        geometry = shapely.from_geojson(df.pop('.geo').to_numpy()) if len(df) else []
+        return gpd.GeoDataFrame(df, geometry=geometry, crs='epsg:4326')
+
+    def fetch_counts(self, cells: list) -> dict:
+        """
+        Fetches the building counts of quadtree cells, answering from the count cache where possible.
+        All uncached cells are counted server side in a single Earth Engine call.
+        
+        Args:
+            cells (list): (level, x, y) quadtree cells.
+
+        Returns:
+            dict: Count of buildings per cell.
+        """
+        with self.counts_lock:
+            if self.counts is None:
+                self.counts = self._load_counts()
+            missing = [cell for cell in cells if self._cell_key(cell) not in self.counts]
+
+        if missing:
+            # One feature per cell, each one counting the buildings intersecting it
+            buildings = ee.FeatureCollection(self.collection)
+            grid = ee.FeatureCollection([
+                ee.Feature(ee.Geometry.Rectangle(list(self._cell_bounds(cell)), 'EPSG:4326', False), {'key': self._cell_key(cell)})
+                for cell in missing
+            ])
+            grid = grid.map(lambda cell: cell.set('count', buildings.filterBounds(cell.geometry()).size()))
+            counts = ee.Dictionary.fromLists(grid.aggregate_array('key'), grid.aggregate_array('count')).getInfo()
+
+            with self.counts_lock:
+                self.counts.update(counts)
+                self._save_counts()
+
+        return {cell: self.counts[self._cell_key(cell)] for cell in cells}
+
+    def _cell_key(self, cell: tuple) -> str:
+        """
+        Cache key of a (level, x, y) cell.
+        """
+        return "{}/{}/{}".format(*cell)
+
+    def _cell_bounds(self, cell: tuple) -> tuple:
+        """
+        Bounds of a (level, x, y) cell of the global quadtree, whose cells are 360 / 2**level degrees wide.
+        """
+        level, x, y = cell
+        size = 360 / 2 ** level
+        return (-180 + x * size, -90 + y * size, -180 + (x + 1) * size, -90 + (y + 1) * size)
+
+    def _counts_path(self) -> str:
+        """
+        Path of the count cache of the current collection.
+        """
+        return os.path.join(self.cache_dir, self.collection.replace('/', '_') + '_counts.json')
+
+    def _load_counts(self) -> dict:
+        """
+        Reads the persistent count cache, empty without a cache_dir.
+        """
+        if self.cache_dir is None or not os.path.exists(self._counts_path()):
+            return {}
+        with open(self._counts_path(), 'r') as f:
+            return json.load(f)
+
+    def _save_counts(self):
+        """
+        Writes the count cache atomically.
         """
-        # Return the count of buildings in the polygon
-        return ee.FeatureCollection("GOOGLE/Research/open-buildings/v3/polygons").filterBounds(
-            ee.Geometry(polygon.__geo_interface__)).size().getInfo()
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self._counts_path() + f'.{os.getpid()}.part'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.counts, f)
+        os.replace(tmp_path, self._counts_path())
         
-    def split_polygon(self, polygon: Polygon, grid_size: float = 20000*(9e-6), max_counts: int = 10000) -> list:
+    def split_polygon(self, polygon: Polygon, max_counts: int = 10000) -> list:
         """
-        Splits a polygon into smaller grid-based rectangles to manage large feature counts.
+        Splits a polygon along a global quadtree until every part holds at most max_counts buildings.
+        The counts of a whole level are fetched in one call, cells over the limit are split in four
+        and counted at the next level.
         
         Args:
             polygon (shapely.geometry.Polygon): Input polygon.
-            grid_size (float): Size of each grid cell.
-            max_counts (int): Maximum allowed feature count per grid.
+            max_counts (int): Maximum allowed feature count per part.
 
         Returns:
             list: List of split polygons that meet the max_counts requirement.
         """
+        # Start at the level whose cells are about as large as the polygon
         min_x, min_y, max_x, max_y = polygon.bounds
-        rectangles = []
-        counts = []
-        
-        # Generate grid of rectangles within the polygon bounds
-        for x in np.arange(min_x, max_x, grid_size):
-            for y in np.arange(min_y, max_y, grid_size):
-                rectangle = Polygon([
-                    (x, y),
-                    (x + grid_size, y),
-                    (x + grid_size, y + grid_size),
-                    (x, y + grid_size)
-                ]).intersection(polygon).buffer(grid_size/100)
-                
-                # Skip if rectangle area is zero
-                if rectangle.area == 0:
-                    continue
-
-                # Fetch building counts for each rectangle
-                counts.append(self.fetch_counts(rectangle))
-                rectangles.append(rectangle)
-        
-        # Compute building counts for all rectangles
-        counts = dask.compute(*counts)
-        
-        refined_rectangles = []
-        
-        # Recursively split rectangles if they exceed max_counts
-        for index in range(len(counts)):
-            if counts[index] > max_counts:
-                refined_rectangles.extend(self.split_polygon(rectangles[index], grid_size=grid_size/2, max_counts=max_counts))
-            else:
-                refined_rectangles.append(rectangles[index])
-        
-        return refined_rectangles
+        extent = max(max_x - min_x, max_y - min_y, 1e-9)
+        cells = self._covering_cells(polygon, int(np.clip(np.floor(np.log2(360 / extent)), 0, self.max_level)))
+
+        parts = []
+        while cells:
+            boxes = shapely.box(*np.array([self._cell_bounds(cell) for cell in cells]).T)
+            hits = shapely.intersects(boxes, polygon)
+            cells, boxes = [cell for cell, hit in zip(cells, hits) if hit], boxes[hits]
+            if not cells:
+                break
+            counts = self.fetch_counts(cells)
+
+            children = []
+            for cell, cell_box in zip(cells, boxes):
+                level, x, y = cell
+                if counts[cell] > max_counts and level < self.max_level:
+                    children.extend((level + 1, 2 * x + dx, 2 * y + dy) for dx in (0, 1) for dy in (0, 1))
+                elif counts[cell] > 0:
+                    part = cell_box.intersection(polygon)
+                    # Skip parts that only touch the polygon
+                    if part.area > 0:
+                        parts.append(part)
+            cells = children
+
+        return parts
+
+    def _covering_cells(self, polygon: Polygon, level: int) -> list:
+        """
+        (level, x, y) cells of the global quadtree covering the bounds of a polygon.
+        """
+        min_x, min_y, max_x, max_y = polygon.bounds
+        size = 360 / 2 ** level
+        return [
+            (level, x, y)
+            for x in range(int((min_x + 180) // size), int((max_x + 180) // size) + 1)
+            for y in range(int((min_y + 90) // size), int((max_y + 90) // size) + 1)
+        ]
+
+    def _store_path(self, cell: tuple) -> str:
+        """
+        Path of the store partition of a cell.
+        """
+        return os.path.join(self.store_dir, "{}_{}_{}.parquet".format(*cell))
+
+    def mirror(self, lat=None, lon=None, radius=None, polygon=None) -> list:
+        """
+        Mirrors the buildings of a region into the local store. Every store cell touching the region
+        is fetched whole and written as its own GeoParquet partition, holding every building that
+        intersects the cell (buildings across cell edges are stored in each of their cells), with
+        bbox columns and rows sorted along a Z-order curve so that row-group statistics prune bbox
+        reads.
+
+        Args:
+            polygon (shapely.geometry.Polygon): Region to mirror, EPSG:4326.
+
+        Returns:
+            list: Paths of the written partitions.
+        """
+        if self.store_dir is None:
+            raise ValueError("store_dir is required to mirror buildings.")
+        if polygon is None :
+            polygon = Point(lon,lat).buffer(radius/111/1000)
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        paths = []
+        cells = self._covering_cells(polygon, self.store_level)
+        boxes = shapely.box(*np.array([self._cell_bounds(cell) for cell in cells]).T)
+        for cell, cell_box in zip(cells, boxes):
+            if not cell_box.intersects(polygon):
+                continue
+            gdf = self.fetch_remote(cell_box)
+            geometry = gdf.geometry.values
+            wkb = shapely.to_wkb(geometry)
+
+            # Parts of a cell overlap on their edges
+            keep = shapely.intersects(geometry, cell_box) & ~pd.Series(wkb).duplicated().to_numpy()
+
+            bounds = shapely.bounds(geometry[keep])
+            df = pd.DataFrame({
+                column: gdf[column].values[keep]
+                for column in ('area_in_meters', 'confidence', 'full_plus_code') if column in gdf.columns
+            })
+            df['geometry'] = wkb[keep]
+            df['xmin'], df['ymin'], df['xmax'], df['ymax'] = bounds.T
+            df = df.iloc[np.argsort(morton_key((df.xmin + df.xmax).values / 2, (df.ymin + df.ymax).values / 2, self._cell_bounds(cell)), kind='stable')]
+
+            path = self._store_path(cell)
+            tmp_path = f"{path}.{os.getpid()}.part"
+            df.to_parquet(tmp_path, index=False, row_group_size=10000)
+            os.replace(tmp_path, path)
+            paths.append(path)
+        return paths
+
+    def fetch_store(self, polygon: Polygon):
+        """
+        Reads the buildings intersecting a polygon from the local store. Partitions are read with
+        bbox filters, so only intersecting row groups are decoded, and candidates are refined
+        against the polygon with an STRtree. Buildings stored in several cells are returned once.
+
+        Args:
+            polygon (shapely.geometry.Polygon): Input polygon EPSG:4326.
+
+        Returns:
+            gpd.GeoDataFrame: GeoDataFrame with building information.
+            None: If a cell touching the polygon has not been mirrored.
+        """
+        cells = self._covering_cells(polygon, self.store_level)
+        boxes = shapely.box(*np.array([self._cell_bounds(cell) for cell in cells]).T)
+        paths = [self._store_path(cell) for cell, hit in zip(cells, shapely.intersects(boxes, polygon)) if hit]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+
+        min_x, min_y, max_x, max_y = polygon.bounds
+        filters = [('xmin', '<=', max_x), ('xmax', '>=', min_x), ('ymin', '<=', max_y), ('ymax', '>=', min_y)]
+        dfs = [pd.read_parquet(path, filters=filters) for path in paths]
+        df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=['geometry'])
+
+        # Buildings across cell edges are stored in every cell they touch
+        df = df[~df['geometry'].duplicated()].reset_index(drop=True)
+        geometry = shapely.from_wkb(df.pop('geometry').values)
+        index = np.sort(shapely.STRtree(geometry).query(polygon, predicate='intersects'))
+        df = df.drop(columns=['xmin', 'ymin', 'xmax', 'ymax'], errors='ignore').iloc[index].reset_index(drop=True)
+        return gpd.GeoDataFrame(df, geometry=geometry[index], crs='epsg:4326')
 
 
 if __name__ == '__main__':
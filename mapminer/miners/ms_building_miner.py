@@ -1,11 +1,18 @@
 import ee
 import os
+import re
+import gzip
+import hashlib
 import json
+import time
+import requests
+import threading
 import mercantile
 import numpy as np
 import pandas as pd
 import geopandas as gpd
 import dask
+import shapely
 from shapely.geometry import Polygon, Point, shape, box
 
 class MSBuildingMiner:
@@ -13,14 +20,196 @@ class MSBuildingMiner:
     Microsoft Building Miner class for extracting building data from Microsoft Open Buildings dataset using Dask & Numba.
     """
 
-    def __init__(self):
+    links_url = "https://minedbuildings.z5.web.core.windows.net/global-buildings/dataset-links.csv"
+    # Largest footprint extent in degrees assumed by the first-vertex prefilter of fetch_buildings
+    max_extent = 0.05
+    first_vertex = re.compile(rb'"coordinates"\s*:\s*\[+\s*(-?[\d.eE+-]+)\s*,\s*(-?[\d.eE+-]+)')
+
+    def __init__(self, cache_dir=None, index_ttl=30*24*3600):
+        """
+        Initializes the miner. The global quadkey index of tile files is loaded lazily on the first
+        fetch, from an on-disk cache when a fresh one exists.
+
+        Args:
+            cache_dir (str): Directory of the cached index (default: ~/.cache/mapminer/ms_buildings).
+            index_ttl (float): Age in seconds after which the cached index is downloaded again (default: 30 days).
+        """
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "mapminer", "ms_buildings")
+        self.index_ttl = index_ttl
+        self.index = None
+        self.index_lock = threading.Lock()
+
+    def load_index(self) -> dict:
+        """
+        Loads the quadkey index: quadkey ints, their levels, tile bounds and file urls as arrays.
+        The dataset links CSV is only downloaded when the cached copy is missing or stale.
+
+        Returns:
+            dict: Arrays 'quadkey', 'level', 'bounds', 'url'.
+        """
+        with self.index_lock:
+            if self.index is not None:
+                return self.index
+
+            path = os.path.join(self.cache_dir, "dataset-links.npz")
+            if os.path.exists(path) and time.time() - os.path.getmtime(path) < self.index_ttl:
+                with np.load(path) as index:
+                    self.index = dict(index)
+                return self.index
+
+            df_ms = pd.read_csv(self.links_url, dtype={'QuadKey': str})
+            quadkeys = np.asarray(df_ms.QuadKey, dtype=str)
+            unique = {key: self._quadkey_to_geom(key).bounds for key in set(quadkeys)}
+            self.index = {
+                'quadkey': np.array([int(key, 4) for key in quadkeys], dtype=np.int64),
+                'level': np.array([len(key) for key in quadkeys], dtype=np.int8),
+                'bounds': np.array([unique[key] for key in quadkeys], dtype=np.float64).reshape(-1, 4),
+                'url': np.asarray(df_ms.Url, dtype=str),
+            }
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.part.npz"
+            np.savez(tmp_path, **self.index)
+            os.replace(tmp_path, path)
+            return self.index
+
+    def find_tiles(self, polygon: Polygon) -> np.ndarray:
+        """
+        Index rows of the tile files intersecting a polygon. The tiles covering the polygon bounds at the
+        deepest index level are reduced to quadkey prefixes per level and matched as integers, and
+        the few candidates are refined against the polygon.
+
+        Args:
+            polygon (shapely.geometry.Polygon): Input polygon EPSG:4326.
+
+        Returns:
+            np.ndarray: Positions in the index of the intersecting tile files.
+        """
+        index = self.load_index()
+        zoom = int(index['level'].max())
+        covering = np.array([int(mercantile.quadkey(tile), 4) for tile in mercantile.tiles(*polygon.bounds, zooms=zoom)], dtype=np.int64)
+
+        candidates = np.zeros(len(index['quadkey']), dtype=bool)
+        for level in np.unique(index['level']):
+            at_level = index['level'] == level
+            prefixes = np.unique(covering >> (2 * (zoom - int(level))))
+            candidates[at_level] = np.isin(index['quadkey'][at_level], prefixes)
+
+        candidates = np.flatnonzero(candidates)
+        hits = shapely.intersects(shapely.box(*index['bounds'][candidates].T), polygon)
+        return candidates[hits]
+
+    def find_urls(self, polygon: Polygon) -> np.ndarray:
+        """
+        Urls of the tile files intersecting a polygon.
+
+        Args:
+            polygon (shapely.geometry.Polygon): Input polygon EPSG:4326.
+
+        Returns:
+            np.ndarray: Urls of the intersecting tile files.
+        """
+        return self.load_index()['url'][self.find_tiles(polygon)]
+
+    def _mirror_path(self, url: str) -> str:
+        """
+        Path of the local GeoParquet mirror of a tile file.
+        """
+        return os.path.join(self.cache_dir, "tiles", hashlib.sha1(url.encode()).hexdigest()[:16] + ".parquet")
+
+    def mirror(self, lat=None, lon=None, radius=None, polygon=None) -> list:
+        """
+        Converts every tile file intersecting a region into local GeoParquet, so later fetches read
+        only the row groups intersecting the AOI. Rows are sorted in quadkey order and carry bbox
+        columns, which gives every row group tight bbox statistics.
+
+        Args:
+            polygon (shapely.geometry.Polygon): Region to mirror, EPSG:4326.
+
+        Returns:
+            list: Paths of the local mirrors.
+        """
+        if polygon is None : 
+            polygon = Point(lon,lat).buffer(radius/111/1000)
+
+        urls = self.find_urls(polygon)
+        if len(urls)==0:
+            raise ValueError("No data found in Microsoft Buildings dataset for the given region.")
+        os.makedirs(os.path.join(self.cache_dir, "tiles"), exist_ok=True)
+        return list(dask.compute(*[self.mirror_tile(url) for url in urls], scheduler='threads'))
+
+    @dask.delayed
+    def mirror_tile(self, url: str) -> str:
+        """
+        Converts one tile file into a local GeoParquet mirror unless it already exists.
+
+        Args:
+            url (str): Tile file url.
+
+        Returns:
+            str: Path of the local mirror.
+        """
+        path = self._mirror_path(url)
+        if os.path.exists(path):
+            return path
+
+        gdf = self.fetch_buildings(url, box(-180, -90, 180, 90)).compute(scheduler='sync')
+        geometry = gdf.geometry.values
+        bounds = shapely.bounds(geometry)
+        df = pd.DataFrame({
+            'height': gdf['height'].values,
+            'confidence': gdf['confidence'].values,
+            'geometry': shapely.to_wkb(geometry),
+            'xmin': bounds[:, 0], 'ymin': bounds[:, 1], 'xmax': bounds[:, 2], 'ymax': bounds[:, 3],
+        })
+        df = df.iloc[np.argsort(self._quadkey_order((df.xmin + df.xmax).values / 2, (df.ymin + df.ymax).values / 2), kind='stable')]
+
+        tmp_path = f"{path}.{os.getpid()}.part"
+        df.to_parquet(tmp_path, index=False, row_group_size=10000)
+        os.replace(tmp_path, path)
+        return path
+
+    @dask.delayed
+    def read_mirror(self, path: str, polygon: Polygon) -> gpd.GeoDataFrame:
+        """
+        Reads the buildings intersecting a polygon from a local mirror, decoding only the row
+        groups whose bbox statistics intersect the polygon bounds.
+
+        Args:
+            path (str): Local mirror path.
+            polygon (shapely.geometry.Polygon): Input polygon EPSG:4326.
+
+        Returns:
+            gpd.GeoDataFrame: Buildings intersecting the polygon.
+        """
+        min_x, min_y, max_x, max_y = polygon.bounds
+        df = pd.read_parquet(
+            path,
+            columns=['height', 'confidence', 'geometry'],
+            filters=[('xmin', '<=', max_x), ('xmax', '>=', min_x), ('ymin', '<=', max_y), ('ymax', '>=', min_y)],
+        )
+        geometry = shapely.from_wkb(df['geometry'].values)
+        hits = shapely.intersects(geometry, polygon)
+        return gpd.GeoDataFrame({
+            'height': df['height'].values[hits],
+            'confidence': df['confidence'].values[hits],
+        }, index=pd.RangeIndex(hits.sum()), geometry=geometry[hits], crs='epsg:4326')
+
+    def _quadkey_order(self, lon: np.ndarray, lat: np.ndarray, zoom: int = 24) -> np.ndarray:
         """
-        Initializes the miner by loading global quadkey-indexed tile metadata as a GeoDataFrame.
+        Sort key of lon/lat positions following quadkey order at the given zoom, i.e. the Z-order
+        of their Web Mercator tiles.
         """
-        df_ms = pd.read_csv("https://minedbuildings.z5.web.core.windows.net/global-buildings/dataset-links.csv")
-        df_ms['geometry'] = df_ms.QuadKey.apply(lambda key : self._quadkey_to_geom(str(key)))
-        df_ms = gpd.GeoDataFrame(df_ms,crs='epsg:4326')
-        self.df_ms = df_ms
+        n = 2 ** zoom
+        lat = np.radians(np.clip(lat, -85.05112878, 85.05112878))
+        x = np.clip(((np.asarray(lon) + 180) / 360 * n).astype(np.int64), 0, n - 1).astype(np.uint64)
+        y = np.clip(((1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * n).astype(np.int64), 0, n - 1).astype(np.uint64)
+
+        key = np.zeros(len(x), dtype=np.uint64)
+        for bit in range(zoom):
+            key |= ((x >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit)
+            key |= ((y >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + 1)
+        return key
     
     def _quadkey_to_geom(self,quadkey):
         """
@@ -51,22 +240,103 @@ class MSBuildingMiner:
             polygon = Point(lon,lat).buffer(radius/111/1000)
         
         
-        urls = self.df_ms[self.df_ms.intersects(polygon)].Url.values 
+        urls = self.find_urls(polygon)
         if len(urls)==0:
             raise ValueError("No data found in Microsoft Buildings dataset for the given region.")
         
-        dfs = dask.compute(*[self.fetch_buildings(url,polygon) for url in urls],scheduler='threads')
-        df = pd.concat(dfs)
-        df['confidence'] = df.properties.apply(lambda properties : properties['confidence'] if 'confidence' in properties else 1.0).values
-        return df
+        # Mirrored tiles are read locally, the others are streamed from the dataset
+        tasks = [
+            self.read_mirror(self._mirror_path(url), polygon) if os.path.exists(self._mirror_path(url)) else self.fetch_buildings(url, polygon)
+            for url in urls
+        ]
+        dfs = dask.compute(*tasks,scheduler='threads')
+        return pd.concat(dfs, ignore_index=True)
     
     @dask.delayed
-    def fetch_buildings(self,url,polygon):
-        df = pd.read_json(url, lines=True)
-        df['geometry'] = df['geometry'].apply(shape)
-        df = gpd.GeoDataFrame(df, crs='epsg:4326')
-        df = df[df.intersects(polygon)]
-        return df
+    def fetch_buildings(self, url, polygon, chunk_size=50000):
+        """
+        Streams a gzipped GeoJSON-lines tile file and keeps the buildings intersecting a polygon.
+        Lines are decompressed incrementally and rejected on their first vertex before any JSON
+        parsing, and survivors are built in chunks, so memory follows the AOI, not the tile file.
+
+        Args:
+            url (str): Tile file url.
+            polygon (shapely.geometry.Polygon): Input polygon EPSG:4326.
+            chunk_size (int): Number of candidate lines parsed at once.
+
+        Returns:
+            gpd.GeoDataFrame: Buildings intersecting the polygon.
+        """
+        min_x, min_y, max_x, max_y = polygon.bounds
+        min_x, min_y, max_x, max_y = min_x - self.max_extent, min_y - self.max_extent, max_x + self.max_extent, max_y + self.max_extent
+
+        response = requests.get(url, stream=True, timeout=600)
+        response.raise_for_status()
+
+        dfs, lines = [], []
+        with gzip.GzipFile(fileobj=response.raw) as stream:
+            for line in stream:
+                match = self.first_vertex.search(line)
+                if match is not None:
+                    x, y = float(match.group(1)), float(match.group(2))
+                    if not (min_x <= x <= max_x and min_y <= y <= max_y):
+                        continue
+                lines.append(line)
+                if len(lines) >= chunk_size:
+                    dfs.append(self._build_buildings(lines, polygon))
+                    lines = []
+        dfs.append(self._build_buildings(lines, polygon))
+        return pd.concat(dfs, ignore_index=True)
+
+    def _build_buildings(self, lines, polygon):
+        """
+        Parses GeoJSON lines, rejects features by coordinate bbox and builds the surviving polygons
+        with vectorized shapely constructors.
+
+        Args:
+            lines (list): GeoJSON feature lines.
+            polygon (shapely.geometry.Polygon): Input polygon EPSG:4326.
+
+        Returns:
+            gpd.GeoDataFrame: Buildings intersecting the polygon.
+        """
+        features = [json.loads(line) for line in lines]
+        is_simple = [f['geometry']['type'] == 'Polygon' and bool(f['geometry']['coordinates']) and bool(f['geometry']['coordinates'][0]) for f in features]
+        simple = [f for f, flag in zip(features, is_simple) if flag]
+        other = [f for f, flag in zip(features, is_simple) if not flag]
+
+        rings = [ring for f in simple for ring in f['geometry']['coordinates']]
+        ring_counts = np.array([len(f['geometry']['coordinates']) for f in simple], dtype=np.int64)
+        ring_sizes = np.array([len(ring) for ring in rings], dtype=np.int64)
+        coords = np.array([xy[:2] for ring in rings for xy in ring], dtype=np.float64).reshape(-1, 2)
+
+        # Bbox of every feature straight from the flat coordinates
+        ring_feature = np.repeat(np.arange(len(simple)), ring_counts)
+        vertex_feature = np.repeat(ring_feature, ring_sizes)
+        starts = np.searchsorted(vertex_feature, np.arange(len(simple)))
+        keep = np.zeros(len(simple), dtype=bool)
+        if len(simple):
+            mins, maxs = np.minimum.reduceat(coords, starts), np.maximum.reduceat(coords, starts)
+            min_x, min_y, max_x, max_y = polygon.bounds
+            keep = (mins[:, 0] <= max_x) & (maxs[:, 0] >= min_x) & (mins[:, 1] <= max_y) & (maxs[:, 1] >= min_y)
+
+        # Survivors: rings -> polygons, the first ring of every feature being its shell
+        vertex_keep = keep[vertex_feature]
+        ring_keep = keep[ring_feature]
+        ring_ids = np.repeat(np.arange(ring_keep.sum()), ring_sizes[ring_keep])
+        geometry = shapely.polygons(
+            shapely.linearrings(coords[vertex_keep], indices=ring_ids),
+            indices=np.repeat(np.arange(keep.sum()), ring_counts[keep])
+        ) if keep.any() else np.empty(0, dtype=object)
+
+        kept = [f for f, k in zip(simple, keep) if k] + other
+        geometry = np.concatenate([geometry, np.array([shape(f['geometry']) for f in other], dtype=object)])
+        properties = [f.get('properties') or {} for f in kept]
+        hits = shapely.intersects(geometry, polygon)
+        return gpd.GeoDataFrame({
+            'height': np.array([p.get('height') for p in properties], dtype=np.float32)[hits],
+            'confidence': np.array([p.get('confidence', 1.0) for p in properties], dtype=np.float32)[hits],
+        }, index=pd.RangeIndex(hits.sum()), geometry=geometry[hits], crs='epsg:4326')
         
     
  
@@ -1,14 +1,16 @@
 import planetary_computer
 import pystac_client
 import numpy as np
-import geopandas as gpd
 from shapely import unary_union
 import rioxarray
-from rioxarray.merge import merge_arrays
+import dask
+import dask.array as dsa
+from affine import Affine
+from pyproj import Transformer
 from odc.stac import load
 import xarray as xr
 import pandas as pd
-from shapely.geometry import Polygon, Point, box
+from shapely.geometry import Polygon, Point, box, shape
 
 
 class NAIPMiner:
@@ -23,7 +25,9 @@ class NAIPMiner:
         planetary_computer.settings.set_subscription_key("1d7ae9ea9d3843749757036a903ddb6c")  # Replace with your key
         self.catalog_url = "https://stac-api.d2s.org"
         self.catalog = pystac_client.Client.open(self.catalog_url)
-        
+        # EPSG:4326 -> raster CRS transformers, reused across items and fetch calls
+        self._transformers = {}
+
     def _get_utm_crs(self, lon, lat):
         """
         Determines the UTM CRS (EPSG code) based on the provided longitude and latitude.
@@ -65,27 +69,20 @@ class NAIPMiner:
         if len(query) == 0:
             raise ValueError("No NAIP data found for the given date range and bounding box.")
         
+        # Rank dates by how much of the bbox their STAC footprints cover, no asset is opened yet
+        aoi = box(*bbox)
         collections = {}
         for item in query:
-            ds = rioxarray.open_rasterio(
-                item.assets["image"].href, 
-                chunks={"x": 1000, "y": 1000}
-            )
-            ds = ds.rio.clip(
-                geometries=[box(*gpd.GeoDataFrame([{'geometry': box(*bbox)}], crs='epsg:4326')
-                            .to_crs(ds.rio.crs).iloc[0, -1].bounds)],
-                drop=True
-            )
+            footprint = shape(item.geometry).intersection(aoi)
+            if footprint.is_empty:
+                continue
             naip_date = str(pd.to_datetime(item.datetime)).split(" ")[0]
             if naip_date not in collections : 
                 collections[naip_date] = []
-            collection = {
-                'naip_date':naip_date,
-                'crs': ds.rio.crs, 
-                'polygon': box(*ds.rio.bounds()),
-                'ds':ds
-            }
-            collections[naip_date].append(collection) 
+            collections[naip_date].append({'naip_date': naip_date, 'item': item, 'polygon': footprint})
+
+        if len(collections) == 0:
+            raise ValueError("No NAIP data found for the given date range and bounding box.")
         
         collections = sorted(
                 collections.items(),
@@ -93,17 +90,146 @@ class NAIPMiner:
                 reverse=True
             )
         collection = collections[0]
-        ds =  merge_arrays([c['ds'] for c in collection[1]])
+
+        # Open only the winning date's items concurrently, each lazily sliced to the bbox window
+        windows = dask.compute(*[self._open_window(c['item'], bbox) for c in collection[1]], scheduler='threads')
+        windows = [ds for ds in windows if ds is not None]
+        if len(windows) == 0:
+            raise ValueError("No NAIP data found for the given date range and bounding box.")
+
+        ds = self._mosaic(windows, bbox)
         ds.attrs['metadata'] = {'date': {'value': collection[0], 'confidence': 100}}
         
         if reproject:
             utm_crs = self._get_utm_crs(lat=polygon.centroid.y, lon=polygon.centroid.x)
-            ds = ds.rio.reproject(utm_crs).rio.clip(geometries=[box(*gpd.GeoDataFrame([{'geometry':polygon}],crs='epsg:4326').to_crs(utm_crs).iloc[0,-1].bounds)],drop=True)
+            ds = ds.rio.reproject(utm_crs).rio.clip_box(*self._transform_bounds(polygon.bounds, utm_crs))
         else : 
-            ds = ds.rio.clip(geometries=[box(*gpd.GeoDataFrame([{'geometry':polygon}],crs='epsg:4326').to_crs(ds.rio.crs).iloc[0,-1].bounds)],drop=True)
+            ds = self._window(ds, polygon.bounds)
         
         return ds
 
+    def _transform_bounds(self, bbox, crs):
+        """
+        Transforms a lon/lat bounding box into `crs`, reusing one cached transformer per CRS.
+
+        Parameters:
+        - bbox (tuple): Bounding box as (west, south, east, north) in EPSG:4326.
+        - crs: Target CRS.
+
+        Returns:
+        - tuple: (xmin, ymin, xmax, ymax) in `crs`.
+        """
+        key = str(crs)
+        if key not in self._transformers:
+            self._transformers[key] = Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+        return self._transformers[key].transform_bounds(*bbox)
+
+    def _window(self, ds, bbox):
+        """
+        Slices a raster to the pixel window covering a lon/lat bounding box. On a lazily
+        opened COG this only touches the blocks intersecting the window.
+
+        Parameters:
+        - ds (xarray.DataArray): Raster with a CRS and an affine transform.
+        - bbox (tuple): Bounding box as (west, south, east, north) in EPSG:4326.
+
+        Returns:
+        - xarray.DataArray: Windowed raster, or None if the bbox does not overlap it.
+        """
+        xmin, ymin, xmax, ymax = self._transform_bounds(bbox, ds.rio.crs)
+        cols, rows = ~ds.rio.transform() * (np.array([xmin, xmax]), np.array([ymax, ymin]))
+
+        row_start, row_stop = max(int(np.floor(rows.min())), 0), min(int(np.ceil(rows.max())), ds.rio.height)
+        col_start, col_stop = max(int(np.floor(cols.min())), 0), min(int(np.ceil(cols.max())), ds.rio.width)
+        if row_start >= row_stop or col_start >= col_stop:
+            return None
+
+        return ds.isel(y=slice(row_start, row_stop), x=slice(col_start, col_stop))
+
+    @dask.delayed
+    def _open_window(self, item, bbox):
+        """
+        Opens a NAIP item lazily (header read only) and slices it to the bbox window.
+
+        Parameters:
+        - item (pystac.Item): NAIP STAC item.
+        - bbox (tuple): Bounding box as (west, south, east, north) in EPSG:4326.
+
+        Returns:
+        - xarray.DataArray: Windowed raster, or None if the bbox does not overlap it.
+        """
+        ds = rioxarray.open_rasterio(
+            item.assets["image"].href, 
+            chunks={"x": 1000, "y": 1000}
+        )
+        return self._window(ds, bbox)
+
+    def _mosaic(self, arrays, bbox):
+        """
+        Mosaics windowed rasters onto a single grid covering the bbox, snapped to the pixel grid
+        of the first raster. Aligned windows are written block-wise into a lazy dask canvas, so
+        only the intersecting blocks of each COG are ever read; rasters on a different CRS or
+        pixel grid are reprojected onto the canvas first. As with rioxarray's merge_arrays, the
+        first raster wins where rasters overlap, and later rasters only fill its nodata pixels.
+
+        Parameters:
+        - arrays (list): Windowed rasters (xarray.DataArray) of the same date.
+        - bbox (tuple): Bounding box as (west, south, east, north) in EPSG:4326.
+
+        Returns:
+        - xarray.DataArray: Mosaic of all rasters; earlier rasters win where they overlap.
+        """
+        ref = arrays[0]
+        crs, transform = ref.rio.crs, ref.rio.transform()
+        res_x, res_y = transform.a, transform.e
+        nodata = ref.rio.nodata if ref.rio.nodata is not None else 0
+
+        # Canvas covering the bbox, snapped to the reference pixel grid
+        xmin, ymin, xmax, ymax = self._transform_bounds(bbox, crs)
+        x0 = transform.c + np.floor((xmin - transform.c) / res_x) * res_x
+        y0 = transform.f + np.floor((ymax - transform.f) / res_y) * res_y
+        width = int(np.ceil((xmax - x0) / res_x))
+        height = int(np.ceil((ymin - y0) / res_y))
+        canvas_transform = Affine(res_x, 0, x0, 0, res_y, y0)
+
+        canvas = dsa.full(
+            (ref.sizes['band'], height, width), nodata, dtype=ref.dtype,
+            chunks=(ref.sizes['band'], 1000, 1000)
+        )
+        for arr in arrays:
+            t = arr.rio.transform()
+            col, row = (t.c - x0) / res_x, (t.f - y0) / res_y
+            aligned = (
+                arr.rio.crs == crs and np.isclose(t.a, res_x) and np.isclose(t.e, res_y)
+                and np.isclose(col, round(col), atol=1e-3) and np.isclose(row, round(row), atol=1e-3)
+            )
+            if not aligned:
+                arr = arr.rio.reproject(crs, transform=canvas_transform, shape=(height, width), nodata=nodata)
+                canvas = dsa.where((canvas == nodata) & (arr.data != nodata), arr.data, canvas)
+                continue
+
+            row, col = int(round(row)), int(round(col))
+            dst_rows = slice(max(row, 0), min(row + arr.rio.height, height))
+            dst_cols = slice(max(col, 0), min(col + arr.rio.width, width))
+            if dst_rows.start >= dst_rows.stop or dst_cols.start >= dst_cols.stop:
+                continue
+            window = arr.data[:, dst_rows.start - row:dst_rows.stop - row, dst_cols.start - col:dst_cols.stop - col]
+            current = canvas[:, dst_rows, dst_cols]
+            canvas[:, dst_rows, dst_cols] = dsa.where((current == nodata) & (window != nodata), window, current)
+
+        ds = xr.DataArray(
+            canvas,
+            dims=('band', 'y', 'x'),
+            coords={
+                'band': ref.band.values,
+                'y': y0 + (np.arange(height) + 0.5) * res_y,
+                'x': x0 + (np.arange(width) + 0.5) * res_x,
+            },
+            attrs={k: v for k, v in ref.attrs.items() if k not in ('_FillValue', 'scale_factor', 'add_offset')},
+        )
+        ds = ds.rio.write_crs(crs).rio.write_transform(canvas_transform)
+        return ds.rio.write_nodata(nodata) if ref.rio.nodata is not None else ds
+
 # Example usage:
 if __name__ == "__main__":
     naip_miner = NAIPMiner()
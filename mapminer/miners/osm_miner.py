@@ -1,25 +1,102 @@
+import os
+import re
+import gzip
+import random
+import hashlib
 import numpy as np
 import pandas as pd
 import geopandas as gpd
 import json
 import time
-from shapely.geometry import Point, LineString, Polygon
+import shapely
+import pyarrow as pa
+import pyarrow.parquet as pq
+from shapely.geometry import Point, LineString, Polygon, box
 from shapely.ops import unary_union
 import requests
 import dask
+import threading
+import multiprocessing
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing.shared_memory import SharedMemory
 from typing import List, Dict, Union
 
+from ..utils import morton_key
+
 
 class OSMMiner:
     """
     A class to query and process OSM data using Overpass API for multiple layers.
     The data is fetched in parallel using Dask and then processed.
     """
+    # Processing pool shared by all instances and reused across fetch calls
+    _pools = {}
+    _pool_lock = threading.Lock()
+    # Columns of the on-disk .osm.pbf spatial index
+    _pbf_index_schema = pa.schema([
+        ('layer_id', pa.int32()), ('layer_name', pa.string()), ('geometry', pa.binary()),
+        ('xmin', pa.float64()), ('ymin', pa.float64()), ('xmax', pa.float64()), ('ymax', pa.float64()),
+    ])
     
-    def __init__(self):
+    def __init__(self, combined=False, engine="overpass", pbf_path=None, index_dir=None, location_storage="flex_mem", workers=None,
+                 endpoints=None, cache_dir=None, cache_ttl=7*24*3600, snap=0.01,
+                 max_tile_area=0.25, max_tile_depth=8, tile_workers=4):
         """
         Initialize the OSMMiner class with predefined layer configuration.
+
+        Args:
+            combined (bool): Send a single Overpass request per AOI with all layer filters compiled into
+                             named sets, and assign elements to layers locally (default: False, one request
+                             per query).
+            engine (str): 'overpass' (default) queries the public Overpass API, 'pbf' reads a local
+                          .osm.pbf extract offline.
+            pbf_path (str): Path of the .osm.pbf extract (engine='pbf').
+            index_dir (str): Optional directory for an on-disk spatial index of the extract (engine='pbf').
+                             The extract is processed once into GeoParquet and later AOIs read only the
+                             row groups they intersect.
+            location_storage (str): pyosmium node location storage used while streaming the extract,
+                                    e.g. 'flex_mem' or 'dense_file_array,/tmp/nodes.cache' for large files.
+            workers (int): Size of the persistent processing pool (default: number of CPUs). 0 processes
+                           in the calling process.
+            endpoints (list): Overpass interpreter URLs to rotate across, e.g. a local instance first
+                              (default: the public overpass-api.de endpoint).
+            cache_dir (str): Optional directory of the persistent Overpass response cache.
+            cache_ttl (float): Cache entry lifetime in seconds (default: 7 days).
+            snap (float): With a cache, query bboxes are snapped outwards to this grid (degrees) so nearby
+                          and repeated AOIs share entries; results are filtered back to the AOI bounds.
+            max_tile_area (float): AOIs whose bbox exceeds this area (square degrees) are split into a
+                                   quadtree of tiles fetched concurrently. None disables tiling.
+            max_tile_depth (int): Maximum quadtree depth.
+            tile_workers (int): Number of tiles in flight at once, which bounds memory use.
         """
+        self.max_tile_area = max_tile_area
+        self.max_tile_depth = max_tile_depth
+        self.tile_workers = tile_workers
+        self.workers = workers
+        self.scheduler = OverpassScheduler(endpoints or ["https://overpass-api.de/api/interpreter"])
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl
+        self.snap = snap
+        self.combined = combined
+        self.engine = engine
+        self.pbf_path = pbf_path
+        self.index_dir = index_dir
+        self.location_storage = location_storage
+        if engine == "pbf":
+            if pbf_path is None:
+                raise ValueError("pbf_path is required for engine='pbf'.")
+            try:
+                global osmium
+                import osmium
+                import osmium.filter
+            except ImportError as e:
+                raise ImportError(
+                    "⚠️ Optional dependencies missing. "
+                    "Please install with `pip install mapminer[all]` to use engine='pbf'"
+                ) from e
+        elif engine != "overpass":
+            raise ValueError(f"Unknown engine {engine!r}, expected 'overpass' or 'pbf'.")
         # Config containing OSM queries for various geographical features
         self.config = [
             {'layer_id': 45, 'layer_name': 'wind_tower', 'queries': [{'query': '["generator:source"~"wind"]', 'type': 'node'}]},
@@ -56,42 +133,499 @@ class OSMMiner:
         """
         if polygon is None : 
             polygon = Point(lon,lat).buffer(radius/111/1000)
+
+        if self.engine == "pbf":
+            return self.fetch_pbf(polygon)
+
+        tiles = self.split_aoi(polygon)
+        if len(tiles) == 1:
+            df = self.process_layers(self.fetch_layer_results(polygon))
+        else:
+            df = self.fetch_tiles(tiles)
+
+        # Snapped query bboxes reach beyond the AOI, restore its bounds
+        if self.cache_dir is not None and self.snap:
+            df = df[df.intersects(box(*polygon.bounds))]
+        return df
+
+    def fetch_layer_results(self, polygon: Polygon) -> List[tuple]:
+        """
+        Query Overpass for every layer within the bbox of a polygon.
+
+        Args:
+            polygon (Polygon): Geographical polygon bounding box.
+
+        Returns:
+            list: (layer, osm_data) tuples.
+        """
+        # Snapped query bbox makes cache entries reusable
+        if self.cache_dir is not None and self.snap:
+            polygon = box(*self._snap_bounds(polygon.bounds))
+
+        if self.combined:
+            # One request for every layer, elements are split into layers locally
+            osm_data = self.post_overpass_query(self.build_combined_query(polygon))
+            return self.split_layers(osm_data) if osm_data is not None else []
+
         # Create a list to store delayed tasks
         delayed_tasks = []
-        
+
         # Loop through each layer and its queries in self.config
         for layer in self.config:
             for query in layer['queries']:
                 # Append the delayed task for each query
                 delayed_task = self.fetch_overpass_query(polygon, query['query'])
-                delayed_tasks.append((layer, query, delayed_task))
+                delayed_tasks.append((layer, delayed_task))
 
         # Use dask.compute to run all delayed tasks in parallel
-        results = dask.compute(*[task[2] for task in delayed_tasks])
+        results = dask.compute(*[task[1] for task in delayed_tasks])
+        return [(delayed_tasks[i][0], result) for i, result in enumerate(results) if result is not None]
+
+    def split_aoi(self, polygon: Polygon) -> List[Polygon]:
+        """
+        Split the bbox of a polygon into a quadtree of tiles no larger than `max_tile_area`,
+        dropping the cells that miss the polygon.
+
+        Args:
+            polygon (Polygon): Area of interest.
+
+        Returns:
+            list: Tile polygons, [polygon] when the AOI is small enough.
+        """
+        minx, miny, maxx, maxy = polygon.bounds
+        if self.max_tile_area is None or (maxx - minx) * (maxy - miny) <= self.max_tile_area:
+            return [polygon]
+
+        cells, tiles = [(polygon.bounds, 0)], []
+        while cells:
+            (minx, miny, maxx, maxy), depth = cells.pop()
+            if (maxx - minx) * (maxy - miny) <= self.max_tile_area or depth >= self.max_tile_depth:
+                tiles.append(box(minx, miny, maxx, maxy))
+                continue
+            midx, midy = (minx + maxx) / 2, (miny + maxy) / 2
+            children = [(minx, miny, midx, midy), (midx, miny, maxx, midy), (minx, midy, midx, maxy), (midx, midy, maxx, maxy)]
+            hits = shapely.intersects(polygon, shapely.box(*np.array(children).T))
+            cells.extend((child, depth + 1) for child, hit in zip(children, hits) if hit)
+        return tiles
+
+    def fetch_tiles(self, tiles: List[Polygon]) -> gpd.GeoDataFrame:
+        """
+        Fetch tiles concurrently and stream each one into the processor as soon as it arrives.
+        At most `tile_workers` raw Overpass responses are held at a time, and features spanning
+        several tiles are kept once, by OSM type and id.
+
+        Args:
+            tiles (list): Tile polygons from `split_aoi`.
+
+        Returns:
+            gpd.GeoDataFrame: Combined layer_id/layer_name/geometry features.
+        """
+        seen, dfs = {}, []
+        tiles = iter(tiles)
+        with ThreadPoolExecutor(max_workers=self.tile_workers) as executor:
+            pending = {executor.submit(self.fetch_layer_results, tile) for tile in islice(tiles, self.tile_workers)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dfs.append(self.process_layers(future.result(), seen=seen))
+                    pending |= {executor.submit(self.fetch_layer_results, tile) for tile in islice(tiles, 1)}
+
+        dfs = [df for df in dfs if len(df) > 0]
+        return pd.concat(dfs, ignore_index=True) if dfs else self.process_layers([])
+
+    def _snap_bounds(self, bounds: tuple) -> tuple:
+        """
+        Snap (minx, miny, maxx, maxy) outwards to a grid of `self.snap` degrees.
+        """
+        lower = np.floor(np.asarray(bounds[:2]) / self.snap) * self.snap
+        upper = np.ceil(np.asarray(bounds[2:]) / self.snap) * self.snap
+        return tuple(np.round(np.concatenate([lower, upper]), 9).tolist())
+
+    def process_layers(self, layer_results: List[tuple], seen: Dict = None) -> gpd.GeoDataFrame:
+        """
+        Process raw Overpass results of several layers in parallel into a single GeoDataFrame.
+
+        Args:
+            layer_results (list): (layer, osm_data) tuples.
+            seen (dict): Optional layer_id -> sorted feature keys already emitted, updated in place.
+                         Features found there are dropped, which deduplicates across tiles.
+
+        Returns:
+            gpd.GeoDataFrame: Combined layer_id/layer_name/geometry features.
+        """
+        # Layers are packed into compact arrays here and handed to the persistent pool through
+        # shared memory, so neither the Overpass JSON nor the tags are pickled to the workers
+        pool = self._get_pool() if self.workers != 0 else None
+        blocks, results = [], []
+        try:
+            for layer, result in layer_results:
+                arrays = OSMProcessor(result, keep_tags=False).to_arrays()
+                if pool is None:
+                    results.append(process_osm_arrays(arrays))
+                    continue
+                shm, layout = share_arrays(arrays)
+                blocks.append(shm)
+                results.append(pool.submit(process_shared_osm_arrays, shm.name, layout))
+            results = [r if isinstance(r, tuple) else r.result() for r in results]
+        except Exception:
+            # A crashed worker breaks the executor, start a fresh one on the next call
+            with OSMMiner._pool_lock:
+                if getattr(OSMMiner._pools.get(self.workers), '_broken', False):
+                    del OSMMiner._pools[self.workers]
+            raise
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
 
         dfs = []
-        # Create a list of delayed tasks for processing OSM data
-        delayed_dfs = []
-        for i, result in enumerate(results):
-            layer, query, _ = delayed_tasks[i]
-            # Use lambda and dask.delayed for processing OSM data
-            delayed_task = dask.delayed(lambda res: OSMProcessor(res).process_osm_data())(result)
-            delayed_dfs.append((layer, delayed_task))
-        
-        # Compute all delayed tasks in parallel using the 'processes' scheduler
-        processed_results = dask.compute(*[task[1] for task in delayed_dfs], scheduler='processes')
-        
-        # Process the computed results and append to the dfs list
-        for i, processed_df in enumerate(processed_results):
-            layer = delayed_dfs[i][0]
-            if len(processed_df) > 0:
-                processed_df['layer_id'] = layer['layer_id']
-                processed_df['layer_name'] = layer['layer_name']
-                dfs.append(processed_df.loc[:, ['layer_id', 'layer_name','geometry']])
+        for (layer, _), (feature_ids, feature_types, wkb) in zip(layer_results, results):
+            if seen is not None:
+                keys = feature_ids * 4 + feature_types
+                emitted = seen.get(layer['layer_id'], np.empty(0, dtype=np.int64))
+                new = ~np.isin(keys, emitted)
+                seen[layer['layer_id']] = np.union1d(emitted, keys)
+                wkb = wkb[new]
+            if len(wkb) > 0:
+                dfs.append(gpd.GeoDataFrame(
+                    {'layer_id': layer['layer_id'], 'layer_name': layer['layer_name']},
+                    index=pd.RangeIndex(len(wkb)),
+                    geometry=shapely.from_wkb(wkb),
+                    crs='epsg:4326'
+                ))
         
         return pd.concat(dfs) if dfs else gpd.GeoDataFrame(pd.DataFrame(columns=["layer_id","layer_name","geometry"]), geometry="geometry").set_crs('epsg:4326')
-            
-        
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """
+        Return the persistent processing pool of size `workers`, creating it on first use. Pools
+        are shared between miners of the same size. Workers come from a forkserver, since the
+        pool may be started from tile fetching threads and forking a threaded process can deadlock.
+        Platforms without forkserver (Windows) use spawn.
+        """
+        with OSMMiner._pool_lock:
+            if self.workers not in OSMMiner._pools:
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                OSMMiner._pools[self.workers] = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(method)
+                )
+            return OSMMiner._pools[self.workers]
+
+    def build_combined_query(self, polygon: Polygon) -> str:
+        """
+        Compile every layer of self.config into a single Overpass script. Each layer becomes a
+        named set and the union of all sets is recursed down and returned once.
+
+        Args:
+            polygon (Polygon): Geographical polygon bounding box.
+
+        Returns:
+            str: Overpass QL script.
+        """
+        bbox = polygon.bounds
+        statements = []
+        for layer in self.config:
+            selectors = "".join(
+                f"{element}{query['query']};"
+                for query in layer['queries']
+                for element in ('way', 'node', 'relation')
+            )
+            statements.append(f"({selectors})->.layer_{layer['layer_id']};")
+        matched = "".join(f".layer_{layer['layer_id']};" for layer in self.config)
+
+        return "\n".join([
+            f"[out:json][bbox:{bbox[1]},{bbox[0]},{bbox[3]},{bbox[2]}];",
+            *statements,
+            f"({matched})->.matched;",
+            "(.matched;.matched >;);",
+            "out body;",
+        ])
+
+    def _parse_filter(self, query: str) -> List[tuple]:
+        """
+        Parse an Overpass tag filter such as '["highway"~"trunk|motorway"]["bridge"]' into
+        (key, operator, value) conditions that are ANDed together.
+        """
+        return [
+            (key, op or None, value)
+            for key, op, value in re.findall(r'\["([^"]+)"(?:\s*(!=|=|!~|~)\s*"([^"]*)")?\]', query)
+        ]
+
+    def _match_conditions(self, tags: pd.DataFrame, conditions: List[tuple]) -> np.ndarray:
+        """
+        Vectorized evaluation of parsed filter conditions against a table of tag values.
+        """
+        mask = np.ones(len(tags), dtype=bool)
+        for key, op, value in conditions:
+            column = tags[key] if key in tags.columns else pd.Series(None, index=tags.index, dtype=object)
+            present = column.notna().to_numpy()
+            if op is None:
+                mask &= present
+            elif op == '=':
+                mask &= (column == value).to_numpy()
+            elif op == '!=':
+                mask &= ~(column == value).to_numpy()
+            elif op == '~':
+                mask &= present & column.str.contains(value, regex=True, na=False).to_numpy()
+            elif op == '!~':
+                mask &= ~(present & column.str.contains(value, regex=True, na=False).to_numpy())
+        return mask
+
+    def _filter_keys(self) -> set:
+        """
+        All tag keys referenced by the layer filters of self.config.
+        """
+        return {key for layer in self.config for query in layer['queries'] for key, _, _ in self._parse_filter(query['query'])}
+
+    def match_layers(self, tagged: List[Dict]) -> List[np.ndarray]:
+        """
+        Evaluate every layer of self.config against tagged elements, vectorized per condition.
+
+        Args:
+            tagged (list): Overpass-style elements with a 'tags' dict.
+
+        Returns:
+            list: One boolean mask over `tagged` per layer of self.config.
+        """
+        tags = pd.DataFrame({key: [el['tags'].get(key) for el in tagged] for key in self._filter_keys()}, index=range(len(tagged)), dtype=object)
+
+        masks = []
+        for layer in self.config:
+            mask = np.zeros(len(tagged), dtype=bool)
+            for query in layer['queries']:
+                mask |= self._match_conditions(tags, self._parse_filter(query['query']))
+            masks.append(mask)
+        return masks
+
+    def split_layers(self, osm_data: Dict) -> List[tuple]:
+        """
+        Split the result of a combined query into per-layer Overpass results, equivalent to what
+        the per-layer queries would have returned: the matching elements plus their members
+        (ways and nodes of relations, nodes of ways).
+
+        Args:
+            osm_data (dict): Overpass JSON of the combined query.
+
+        Returns:
+            list: (layer, osm_data) tuples for layers with at least one match.
+        """
+        elements = osm_data['elements']
+        by_key = {(el['type'], el['id']): el for el in elements}
+        tagged = [el for el in elements if el.get('tags')]
+
+        layer_results = []
+        for layer, mask in zip(self.config, self.match_layers(tagged)):
+            if not mask.any():
+                continue
+
+            # Recurse down (relation -> ways/nodes, way -> nodes) like Overpass '>'
+            selected = {}
+            for el in (tagged[i] for i in np.flatnonzero(mask)):
+                selected[(el['type'], el['id'])] = el
+                members = [(m['type'], m['ref']) for m in el.get('members', []) if m['type'] in ('way', 'node')]
+                members += [('node', ref) for ref in el.get('nodes', [])]
+                for member_key in members:
+                    member = by_key.get(member_key)
+                    if member is None:
+                        continue
+                    selected[member_key] = member
+                    for ref in member.get('nodes', []):
+                        if ('node', ref) in by_key:
+                            selected[('node', ref)] = by_key[('node', ref)]
+
+            layer_results.append((layer, {'elements': list(selected.values())}))
+        return layer_results
+
+    def fetch_pbf(self, polygon: Polygon) -> gpd.GeoDataFrame:
+        """
+        Fetch all layers for a polygon from the local .osm.pbf extract (engine='pbf'). Uses the
+        on-disk spatial index when index_dir is set, building it on first use.
+
+        Args:
+            polygon (Polygon): Geographical polygon bounding box.
+
+        Returns:
+            gpd.GeoDataFrame: layer_id/layer_name/geometry features intersecting the polygon bounds.
+        """
+        if self.index_dir is None:
+            gdf = self.process_layers(self.split_layers(self.read_pbf(polygon.bounds)))
+            # Member ways outside the bbox are read to close relations, but must not come back
+            # as standalone features
+            return gdf[shapely.intersects(gdf.geometry.values, box(*polygon.bounds))]
+
+        index_path = self._pbf_index_path()
+        if not os.path.exists(index_path):
+            self.build_pbf_index()
+
+        minx, miny, maxx, maxy = polygon.bounds
+        df = pd.read_parquet(
+            index_path,
+            filters=[('xmin', '<=', maxx), ('xmax', '>=', minx), ('ymin', '<=', maxy), ('ymax', '>=', miny)],
+        )
+        gdf = gpd.GeoDataFrame(
+            df.loc[:, ['layer_id', 'layer_name']],
+            geometry=shapely.from_wkb(df['geometry'].values),
+            crs='epsg:4326'
+        )
+        # Overlapping bboxes are only candidates, keep the geometries meeting the AOI bbox
+        return gdf[shapely.intersects(gdf.geometry.values, box(*polygon.bounds))]
+
+    def read_pbf(self, bbox: tuple = None) -> Dict:
+        """
+        Stream the .osm.pbf extract and collect, in Overpass JSON layout, the elements carrying a
+        key used by self.config that fall in the bbox, plus the ways and nodes needed to build
+        their geometries. Only those elements are kept in memory; untagged nodes are dropped by
+        pyosmium filters before they reach Python.
+
+        Args:
+            bbox (tuple): (minx, miny, maxx, maxy) in EPSG:4326, or None for the whole extract.
+
+        Returns:
+            dict: {'elements': [...]} like an Overpass response.
+        """
+        return {'elements': [el for chunk in self.iter_pbf(bbox) for el in chunk['elements']]}
+
+    def iter_pbf(self, bbox: tuple = None, chunk_size: int = None):
+        """
+        Stream the .osm.pbf extract like `read_pbf`, yielding the elements in self-contained chunks
+        of about chunk_size tagged nodes and ways, each with the nodes its ways need. Member ways
+        of candidate relations are held back and yielded with the relations in the last chunk, so
+        no way is yielded twice and memory is bounded by the chunk plus the relation members.
+
+        Args:
+            bbox (tuple): (minx, miny, maxx, maxy) in EPSG:4326, or None for the whole extract.
+            chunk_size (int): Number of tagged nodes and ways per chunk, or None for a single chunk.
+
+        Yields:
+            dict: {'elements': [...]} like an Overpass response.
+        """
+        keys = self._filter_keys()
+        in_bbox = (lambda lon, lat: True) if bbox is None else (
+            lambda lon, lat: bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]
+        )
+
+        # Pass 1: candidate relations and the ways they need
+        relations = []
+        for relation in osmium.FileProcessor(self.pbf_path, osmium.osm.RELATION).with_filter(osmium.filter.KeyFilter(*keys)):
+            relations.append({
+                'type': 'relation',
+                'id': relation.id,
+                'tags': {tag.k: tag.v for tag in relation.tags},
+                'members': [{'type': {'n': 'node', 'w': 'way', 'r': 'relation'}[m.type], 'ref': m.ref, 'role': m.role} for m in relation.members],
+            })
+        relations = [el for el, *matches in zip(relations, *self.match_layers(relations)) if any(matches)]
+        member_ways = {m['ref'] for el in relations for m in el['members'] if m['type'] == 'way'}
+
+        # Pass 2: tagged nodes and ways (with node locations), plus member ways of relations
+        nodes, ways, coords = [], [], {}
+        members, member_coords, members_in_bbox = [], {}, set()
+        processor = (
+            osmium.FileProcessor(self.pbf_path, osmium.osm.NODE | osmium.osm.WAY)
+            .with_locations(self.location_storage)
+            .with_filter(osmium.filter.KeyFilter(*keys).enable_for(osmium.osm.NODE))
+        )
+        for obj in processor:
+            if obj.is_node():
+                if in_bbox(obj.location.lon, obj.location.lat):
+                    nodes.append({'type': 'node', 'id': obj.id, 'lat': obj.location.lat, 'lon': obj.location.lon,
+                                  'tags': {tag.k: tag.v for tag in obj.tags}})
+            else:
+                is_member = obj.id in member_ways
+                if not is_member and not any(key in obj.tags for key in keys):
+                    continue
+                refs = [(n.ref, n.location.lon, n.location.lat) for n in obj.nodes if n.location.valid()]
+                if not refs:
+                    continue
+                lons, lats = np.array([r[1] for r in refs]), np.array([r[2] for r in refs])
+                intersects = bbox is None or shapely.intersects(
+                    shapely.linestrings(np.c_[lons, lats]) if len(refs) > 1 else shapely.points(lons[0], lats[0]),
+                    shapely.box(*bbox)
+                )
+                if not (intersects or is_member):
+                    continue
+                way = {'type': 'way', 'id': obj.id, 'nodes': [r[0] for r in refs], 'tags': {tag.k: tag.v for tag in obj.tags}}
+                if is_member:
+                    members.append(way)
+                    member_coords.update((ref, (lon, lat)) for ref, lon, lat in refs)
+                    if intersects:
+                        members_in_bbox.add(obj.id)
+                else:
+                    ways.append(way)
+                    coords.update((ref, (lon, lat)) for ref, lon, lat in refs)
+
+            if chunk_size is not None and len(nodes) + len(ways) >= chunk_size:
+                yield self._pbf_chunk(nodes, ways, coords)
+                nodes, ways, coords = [], [], {}
+
+        # Relations count as in the bbox when one of their member ways is
+        relations = [el for el in relations if any(m['type'] == 'way' and m['ref'] in members_in_bbox for m in el['members'])]
+        coords.update(member_coords)
+        yield self._pbf_chunk(nodes, ways + members, coords, relations)
+
+    def _pbf_chunk(self, nodes: List[Dict], ways: List[Dict], coords: Dict, relations: List[Dict] = ()) -> Dict:
+        """
+        Overpass-style result of tagged nodes, ways and relations, with the untagged nodes the
+        ways need built from their coordinates.
+        """
+        tagged_node_ids = {el['id'] for el in nodes}
+        nodes = nodes + [{'type': 'node', 'id': ref, 'lon': lon, 'lat': lat} for ref, (lon, lat) in coords.items() if ref not in tagged_node_ids]
+        return {'elements': nodes + ways + list(relations)}
+
+    def _pbf_index_path(self) -> str:
+        """
+        Path of the spatial index of the extract, keyed by the extract and the layer configuration.
+        """
+        stat = os.stat(self.pbf_path)
+        fingerprint = hashlib.sha1(
+            json.dumps([os.path.abspath(self.pbf_path), stat.st_size, stat.st_mtime, self.config], sort_keys=True).encode()
+        ).hexdigest()[:16]
+        name = os.path.basename(self.pbf_path).split('.')[0]
+        return os.path.join(self.index_dir, f"{name}-{fingerprint}.parquet")
+
+    def build_pbf_index(self, chunk_size: int = 500000) -> str:
+        """
+        Process the whole extract once into a GeoParquet-like spatial index: one row per feature
+        with WKB geometry and bbox columns. The extract is processed in chunks of chunk_size tagged
+        nodes and ways (see `iter_pbf`), each sorted along a Z-order curve and appended to the file,
+        so that row-group statistics prune efficiently on bbox filters while memory stays bounded.
+
+        Args:
+            chunk_size (int): Number of tagged nodes and ways processed at once.
+
+        Returns:
+            str: Path of the index file.
+        """
+        os.makedirs(self.index_dir, exist_ok=True)
+        index_path = self._pbf_index_path()
+        tmp_path = f"{index_path}.{os.getpid()}.part"
+
+        writer = None
+        try:
+            for chunk in self.iter_pbf(None, chunk_size):
+                gdf = self.process_layers(self.split_layers(chunk))
+                if len(gdf) == 0:
+                    continue
+                bounds = shapely.bounds(gdf.geometry.values)
+                df = pd.DataFrame({
+                    'layer_id': gdf['layer_id'].astype('int32').values,
+                    'layer_name': gdf['layer_name'].astype(str).values,
+                    'geometry': shapely.to_wkb(gdf.geometry.values),
+                    'xmin': bounds[:, 0], 'ymin': bounds[:, 1], 'xmax': bounds[:, 2], 'ymax': bounds[:, 3],
+                })
+                df = df.iloc[np.argsort(morton_key((df.xmin + df.xmax).values / 2, (df.ymin + df.ymax).values / 2), kind='stable')]
+
+                table = pa.Table.from_pandas(df, schema=self._pbf_index_schema, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, self._pbf_index_schema)
+                writer.write_table(table, row_group_size=10000)
+            if writer is None:
+                pq.write_table(self._pbf_index_schema.empty_table(), tmp_path)
+        finally:
+            if writer is not None:
+                writer.close()
+        os.replace(tmp_path, index_path)
+        return index_path
+
     @dask.delayed
     def fetch_overpass_query(self, polygon: Polygon, query: str) -> Union[Dict, None]:
         """
@@ -117,64 +651,371 @@ class OSMMiner:
             out body;
         """
         
-        max_retries = 10
-        retry_delay = 2  # seconds between retries
-        
-        # Retry the request if it fails
-        for attempt in range(max_retries):
-            try:
-                response = requests.post("https://overpass-api.de/api/interpreter", data=overpass_query)
-                response.raise_for_status()  # Raise an exception for HTTP errors
-                osm_data = response.json()  # Try to decode JSON
-                return osm_data
-            except requests.exceptions.RequestException:
-                time.sleep(retry_delay)  # Wait before retrying
-            except json.JSONDecodeError:
-                time.sleep(retry_delay)  # Wait before retrying
-            except Exception as e:
-                print(f"Unexpected error occurred: {e}. Retrying in {retry_delay} seconds...")
-        
-        return None  # Return None if all retries fail
+        return self.post_overpass_query(overpass_query)
+
+    def post_overpass_query(self, overpass_query: str) -> Union[Dict, None]:
+        """
+        Send an Overpass QL script through the scheduler, answering from the persistent response
+        cache when a fresh entry exists.
+
+        Args:
+            overpass_query (str): Overpass QL script.
+
+        Returns:
+            dict: Parsed OSM data in JSON format.
+            None: If the request fails after retries.
+        """
+        cache_path = None
+        if self.cache_dir is not None:
+            key = hashlib.sha1(" ".join(overpass_query.split()).encode()).hexdigest()
+            cache_path = os.path.join(self.cache_dir, f"{key}.json.gz")
+            if os.path.exists(cache_path) and time.time() - os.path.getmtime(cache_path) < self.cache_ttl:
+                with gzip.open(cache_path, 'rt') as f:
+                    return json.load(f)
+
+        osm_data = self.scheduler.post(overpass_query)
+
+        # Responses cut short by a server-side error (reported in 'remark') are not cached
+        if cache_path is not None and osm_data is not None and 'error' not in osm_data.get('remark', ''):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.part"
+            with gzip.open(tmp_path, 'wt') as f:
+                json.dump(osm_data, f)
+            os.replace(tmp_path, cache_path)
+        return osm_data
 
     
+class OverpassScheduler:
+    """
+    Sends Overpass queries across one or more endpoints. Concurrent queries to an endpoint are
+    bounded by a semaphore sized from the slot count on its `/status` page, which is cached and
+    only re-read once stale or after a `429`. `429`/`503`/`504` responses honour `Retry-After`,
+    and failures back off exponentially with jitter. Endpoints cooling down are skipped in favour
+    of the others.
+    """
+
+    def __init__(self, endpoints: List[str], max_retries: int = 10, base_delay: float = 2.0, max_delay: float = 120.0, timeout: float = 300,
+                 status_ttl: float = 60.0, max_concurrency: int = 4):
+        """
+        Initialize the scheduler.
+
+        Args:
+            endpoints (list): Overpass interpreter URLs.
+            max_retries (int): Attempts per query before giving up.
+            base_delay (float): First backoff delay in seconds, doubled per attempt.
+            max_delay (float): Upper bound of a single backoff delay in seconds.
+            timeout (float): HTTP timeout of a query in seconds.
+            status_ttl (float): Seconds a `/status` reading stays valid.
+            max_concurrency (int): Concurrent queries to endpoints without a rate limit or status page.
+        """
+        self.endpoints = list(endpoints)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.status_ttl = status_ttl
+        self.max_concurrency = max_concurrency
+        self.next_allowed = {endpoint: 0.0 for endpoint in self.endpoints}
+        self.status = {}
+        self.slots = {}
+        self.status_locks = {endpoint: threading.Lock() for endpoint in self.endpoints}
+        self.cursor = 0
+        self.lock = threading.Lock()
+
+    def choose_endpoint(self) -> tuple:
+        """
+        Pick the endpoint that becomes available first, rotating between equally available ones.
+
+        Returns:
+            tuple: (endpoint, seconds to wait before using it).
+        """
+        with self.lock:
+            now = time.monotonic()
+            order = self.endpoints[self.cursor:] + self.endpoints[:self.cursor]
+            self.cursor = (self.cursor + 1) % len(self.endpoints)
+            endpoint = min(order, key=lambda e: max(self.next_allowed[e], now))
+            return endpoint, max(self.next_allowed[endpoint] - now, 0.0)
+
+    def read_status(self, endpoint: str) -> tuple:
+        """
+        Read the endpoint's `/status` page. Endpoints without a status page or rate limit
+        (e.g. local instances) get `max_concurrency` slots.
+
+        Returns:
+            tuple: (slots, seconds until a slot frees up when none is available now).
+        """
+        try:
+            response = requests.get(endpoint.rsplit('/', 1)[0] + '/status', timeout=10)
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            return self.max_concurrency, 0.0
+
+        text = response.text
+        limit = re.search(r'Rate limit: (\d+)', text)
+        if limit is None or int(limit.group(1)) == 0:
+            return self.max_concurrency, 0.0
+        available = re.search(r'(\d+) slots? available now', text)
+        waits = [int(w) for w in re.findall(r'in (-?\d+) seconds', text)]
+        wait = 0.0 if (available and int(available.group(1)) > 0) or not waits else float(max(min(waits), 0))
+        return int(limit.group(1)), wait
+
+    def endpoint_status(self, endpoint: str) -> tuple:
+        """
+        Cached status of an endpoint, re-read when older than `status_ttl`. Only one thread
+        queries `/status` at a time, and the slot semaphore is resized when the limit changes.
+
+        Returns:
+            tuple: (slot semaphore, monotonic time at which a slot is expected to be free).
+        """
+        with self.status_locks[endpoint]:
+            with self.lock:
+                cached = self.status.get(endpoint)
+            if cached is None or time.monotonic() - cached[0] >= self.status_ttl:
+                slots, wait = self.read_status(endpoint)
+                now = time.monotonic()
+                with self.lock:
+                    self.status[endpoint] = cached = (now, now + wait)
+                    if self.slots.get(endpoint, (None,))[0] != slots:
+                        self.slots[endpoint] = (slots, threading.BoundedSemaphore(slots))
+            with self.lock:
+                return self.slots[endpoint][1], cached[1]
+
+    def expire_status(self, endpoint: str):
+        """
+        Force the next query to the endpoint to re-read its `/status` page.
+        """
+        with self.lock:
+            self.status.pop(endpoint, None)
+
+    def backoff(self, endpoint: str, attempt: int, retry_after: str = None):
+        """
+        Put an endpoint on cooldown, for `Retry-After` seconds when given, otherwise for an
+        exponentially growing delay with jitter.
+        """
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = random.uniform(0.5, 1.0) * min(self.max_delay, self.base_delay * 2 ** attempt)
+        with self.lock:
+            self.next_allowed[endpoint] = max(self.next_allowed[endpoint], time.monotonic() + delay)
+
+    def post(self, overpass_query: str) -> Union[Dict, None]:
+        """
+        Send an Overpass QL script, retrying across endpoints.
+
+        Args:
+            overpass_query (str): Overpass QL script.
+
+        Returns:
+            dict: Parsed OSM data in JSON format.
+            None: If the request fails after retries.
+        """
+        for attempt in range(self.max_retries):
+            endpoint, delay = self.choose_endpoint()
+            if delay > 0:
+                time.sleep(delay)
+
+            semaphore, available_at = self.endpoint_status(endpoint)
+            with semaphore:
+                delay = available_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+                try:
+                    response = requests.post(endpoint, data=overpass_query, timeout=self.timeout)
+                    if response.status_code in (429, 503, 504):
+                        if response.status_code == 429:
+                            self.expire_status(endpoint)
+                        self.backoff(endpoint, attempt, response.headers.get('Retry-After'))
+                        continue
+                    response.raise_for_status()  # Raise an exception for HTTP errors
+                    return response.json()  # Try to decode JSON
+                except (requests.exceptions.RequestException, json.JSONDecodeError):
+                    self.backoff(endpoint, attempt)
+
+        return None  # Return None if all retries fail
+
+
 class OSMProcessor:
     """
     A class to process OSM data into usable geospatial formats (GeoDataFrames).
+
+    Nodes and ways are held as flat arrays (sorted node ids + coordinates, ragged way node
+    lists with offsets) so coordinates are gathered with `np.searchsorted` and geometries are
+    built in bulk with shapely's vectorized constructors.
     """
     
-    def __init__(self, osm_data: Dict):
+    def __init__(self, osm_data: Dict = None, arrays: Dict = None, keep_tags: bool = True):
         """
         Initialize the OSMProcessor class with OSM data.
 
         Args:
             osm_data (dict): OSM data to be processed.
+            arrays (dict): Compact arrays from `to_arrays`, used instead of osm_data (tags are not kept).
+            keep_tags (bool): Whether to keep node/way tags for the 'tags' output column.
         """
         self.osm_data = osm_data
-        self.df_nodes, self.df_ways, self.df_relations = self.create_osm_dataframes()
-        self.processed_way_ids = set()
-        self.processed_node_ids = set()
+        if arrays is not None:
+            self.load_arrays(arrays)
+        else:
+            self.create_osm_arrays(keep_tags)
+        self.way_done = np.zeros(len(self.way_ids), dtype=bool)
+        self.node_done = np.zeros(len(self.node_ids), dtype=bool)
         self.processed_features = []
 
-    def create_osm_dataframes(self) -> tuple:
+    def create_osm_arrays(self, keep_tags: bool = True):
         """
-        Create DataFrames for OSM nodes, ways, and relations.
+        Create array representations of OSM nodes and ways, and keep relations as a list.
+
+        Nodes: node_ids (sorted, int64), node_coords (n, 2) lon/lat, node_tags.
+        Ways: way_ids (sorted, int64), way_offsets (n + 1), way_refs (flat node ids), way_tags.
+        """
+        nodes, ways, self.relations = [], [], []
+        for el in self.osm_data['elements']:
+            if el['type'] == 'node':
+                nodes.append(el)
+            elif el['type'] == 'way':
+                ways.append(el)
+            elif el['type'] == 'relation':
+                self.relations.append(el)
+
+        node_ids = np.fromiter((el['id'] for el in nodes), dtype=np.int64, count=len(nodes))
+        node_ids, first = np.unique(node_ids, return_index=True)
+        self.node_ids = node_ids
+        self.node_coords = np.array([(nodes[i]['lon'], nodes[i]['lat']) for i in first], dtype=np.float64).reshape(-1, 2)
+        self.node_tags = [nodes[i].get('tags', {}) for i in first] if keep_tags else None
+
+        way_ids = np.fromiter((el['id'] for el in ways), dtype=np.int64, count=len(ways))
+        way_ids, first = np.unique(way_ids, return_index=True)
+        ways = [ways[i] for i in first]
+        lengths = np.fromiter((len(el.get('nodes', [])) for el in ways), dtype=np.int64, count=len(ways))
+        self.way_ids = way_ids
+        self.way_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        self.way_refs = np.fromiter(
+            (ref for el in ways for ref in el.get('nodes', [])), dtype=np.int64, count=int(lengths.sum())
+        )
+        self.way_tags = [el.get('tags', {}) for el in ways] if keep_tags else None
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Export nodes, ways and relations as flat numpy arrays (no Python objects), suitable for
+        shared memory. Relations keep their members, roles (inner or not) and whether they are
+        area relations.
 
         Returns:
-            tuple: (df_nodes, df_ways, df_relations) as pandas DataFrames.
+            dict: Name -> np.ndarray.
+        """
+        member_types = {'node': 0, 'way': 1, 'relation': 2}
+        members = [m for el in self.relations for m in el.get('members', [])]
+        lengths = [len(el.get('members', [])) for el in self.relations]
+        return {
+            'node_ids': self.node_ids,
+            'node_coords': self.node_coords,
+            'way_ids': self.way_ids,
+            'way_offsets': self.way_offsets,
+            'way_refs': self.way_refs,
+            'relation_ids': np.array([el['id'] for el in self.relations], dtype=np.int64),
+            'relation_area': np.array([el.get('tags', {}).get('type') in ('multipolygon', 'boundary') for el in self.relations], dtype=bool),
+            'relation_offsets': np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]).astype(np.int64),
+            'member_types': np.array([member_types[m['type']] for m in members], dtype=np.int8),
+            'member_refs': np.array([m['ref'] for m in members], dtype=np.int64),
+            'member_inner': np.array([m.get('role') == 'inner' for m in members], dtype=bool),
+        }
+
+    def load_arrays(self, arrays: Dict[str, np.ndarray]):
+        """
+        Restore the processor state from `to_arrays` output, without tags.
         """
-        df_nodes = pd.DataFrame(
-            [el for el in self.osm_data['elements'] if el['type'] == 'node']
-        ).set_index('id') if any(el['type'] == 'node' for el in self.osm_data['elements']) else pd.DataFrame(columns=['id', 'lon', 'lat', 'tags'])
+        self.node_ids, self.node_coords = arrays['node_ids'], arrays['node_coords']
+        self.way_ids, self.way_offsets, self.way_refs = arrays['way_ids'], arrays['way_offsets'], arrays['way_refs']
+        self.node_tags = self.way_tags = None
 
-        df_ways = pd.DataFrame(
-            [el for el in self.osm_data['elements'] if el['type'] == 'way']
-        ).set_index('id') if any(el['type'] == 'way' for el in self.osm_data['elements']) else pd.DataFrame(columns=['id', 'nodes', 'tags'])
+        member_types = np.array(['node', 'way', 'relation'])[arrays['member_types']]
+        offsets = arrays['relation_offsets']
+        self.relations = [
+            {
+                'type': 'relation',
+                'id': int(relation_id),
+                'tags': {'type': 'multipolygon'} if area else {},
+                'members': [
+                    {'type': member_types[k], 'ref': int(arrays['member_refs'][k]), 'role': 'inner' if arrays['member_inner'][k] else 'outer'}
+                    for k in range(offsets[i], offsets[i + 1])
+                ],
+            }
+            for i, (relation_id, area) in enumerate(zip(arrays['relation_ids'], arrays['relation_area']))
+        ]
 
-        df_relations = pd.DataFrame(
-            [el for el in self.osm_data['elements'] if el['type'] == 'relation']
-        ).set_index('id') if any(el['type'] == 'relation' for el in self.osm_data['elements']) else pd.DataFrame(columns=['id', 'members', 'tags'])
+    def _lookup(self, sorted_ids: np.ndarray, ids: np.ndarray) -> tuple:
+        """
+        Find positions of `ids` in a sorted id array.
 
-        return df_nodes, df_ways, df_relations
+        Returns:
+            tuple: (positions, found) where positions are only valid where found is True.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(sorted_ids) == 0:
+            return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+        positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return positions, sorted_ids[positions] == ids
+
+    def _gather_way_nodes(self, way_index: np.ndarray) -> tuple:
+        """
+        Gather the node positions of several ways at once.
+
+        Args:
+            way_index (np.ndarray): Positions of the ways in self.way_ids.
+
+        Returns:
+            tuple: (owner, node_index) where owner[i] is the position in `way_index` that
+                   node_index[i] belongs to. Nodes missing from the data are dropped.
+        """
+        starts, ends = self.way_offsets[way_index], self.way_offsets[way_index + 1]
+        lengths = ends - starts
+        owner = np.repeat(np.arange(len(way_index)), lengths)
+        flat = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+
+        node_index, found = self._lookup(self.node_ids, self.way_refs[flat])
+        return owner[found], node_index[found]
+
+    def build_way_geometries(self, way_index: np.ndarray) -> np.ndarray:
+        """
+        Build the geometries of several ways in bulk: closed ways with at least 4 coordinates
+        become Polygons, other ways with at least 2 coordinates become LineStrings.
+
+        Args:
+            way_index (np.ndarray): Positions of the ways in self.way_ids.
+
+        Returns:
+            np.ndarray: Geometries aligned with `way_index` (None where a way has too few nodes).
+        """
+        way_index = np.asarray(way_index, dtype=np.int64)
+        geometries = np.full(len(way_index), None, dtype=object)
+        owner, node_index = self._gather_way_nodes(way_index)
+        if len(owner) == 0:
+            return geometries
+
+        coords = self.node_coords[node_index]
+        counts = np.bincount(owner, minlength=len(way_index))
+        first = np.cumsum(counts) - counts
+        has_nodes = counts > 0
+        closed = np.zeros(len(way_index), dtype=bool)
+        closed[has_nodes] = (coords[first[has_nodes]] == coords[first[has_nodes] + counts[has_nodes] - 1]).all(axis=1)
+
+        is_polygon = closed & (counts >= 4)
+        is_line = ~is_polygon & (counts >= 2)
+
+        for mask, build in (
+            (is_polygon, lambda c, i: shapely.polygons(shapely.linearrings(c, indices=i))),
+            (is_line, lambda c, i: shapely.linestrings(c, indices=i)),
+        ):
+            if not mask.any():
+                continue
+            rows = mask[owner]
+            # Re-number owners consecutively, shapely expects 0..n-1 indices
+            targets, indices = np.unique(owner[rows], return_inverse=True)
+            geometries[targets] = build(coords[rows], indices)
+
+        return geometries
 
     def get_way_geometry(self, way_id: int) -> Union[LineString, Polygon]:
         """
@@ -186,73 +1027,233 @@ class OSMProcessor:
         Returns:
             LineString or Polygon: Geometry of the way.
         """
-        nodes = self.df_ways.loc[way_id, 'nodes']
-        coords = [(self.df_nodes.loc[node_id, 'lon'], self.df_nodes.loc[node_id, 'lat']) for node_id in nodes]
-        return Polygon(coords) if coords[0] == coords[-1] else LineString(coords)
+        way_index, found = self._lookup(self.way_ids, [way_id])
+        if not found[0]:
+            raise KeyError(way_id)
+        return self.build_way_geometries(way_index)[0]
+
+    def _mark_ways_processed(self, way_index: np.ndarray):
+        """
+        Mark ways and all of their nodes as processed.
+        """
+        self.way_done[way_index] = True
+        _, node_index = self._gather_way_nodes(np.asarray(way_index, dtype=np.int64))
+        self.node_done[node_index] = True
+
+    def assemble_rings(self, way_index: np.ndarray) -> List[np.ndarray]:
+        """
+        Stitch member ways into closed rings by matching their end node ids. Closed ways are
+        rings on their own; open ways are chained through an endpoint -> way map, so every way
+        is visited once. Chains that never close are dropped.
+
+        Args:
+            way_index (np.ndarray): Positions of the member ways in self.way_ids.
+
+        Returns:
+            list: Node id sequences of the closed rings (first id == last id).
+        """
+        rings, segments = [], []
+        for i in way_index:
+            refs = self.way_refs[self.way_offsets[i]:self.way_offsets[i + 1]]
+            if len(refs) < 2:
+                continue
+            if refs[0] == refs[-1]:
+                rings.append(refs)
+            else:
+                segments.append(refs)
+
+        ends = {}
+        for k, refs in enumerate(segments):
+            ends.setdefault(int(refs[0]), []).append(k)
+            ends.setdefault(int(refs[-1]), []).append(k)
+
+        used = np.zeros(len(segments), dtype=bool)
+        for k in range(len(segments)):
+            if used[k]:
+                continue
+            used[k] = True
+            chain = [segments[k]]
+            start, end = int(segments[k][0]), int(segments[k][-1])
+            while end != start:
+                following = next((j for j in ends[end] if not used[j]), None)
+                if following is None:
+                    break
+                used[following] = True
+                refs = segments[following]
+                if int(refs[0]) != end:
+                    refs = refs[::-1]
+                chain.append(refs[1:])
+                end = int(refs[-1])
+            if end == start:
+                rings.append(np.concatenate(chain))
+
+        return [ring for ring in rings if len(ring) >= 4]
+
+    def build_multipolygons(self, rings: List[np.ndarray], owners: np.ndarray, inner: np.ndarray, count: int) -> np.ndarray:
+        """
+        Build one MultiPolygon per owner from classified rings, in bulk. Inner rings become
+        holes of the smallest outer ring of the same owner that contains them.
+
+        Args:
+            rings (list): Node id sequences of closed rings.
+            owners (np.ndarray): Owner (relation position) of every ring.
+            inner (np.ndarray): Whether every ring has the 'inner' role.
+            count (int): Number of owners.
+
+        Returns:
+            np.ndarray: MultiPolygons aligned with owners 0..count-1 (None where nothing was built).
+        """
+        result = np.full(count, None, dtype=object)
+        if not rings:
+            return result
+
+        # Coordinates of every ring in one lookup, rings with missing nodes are dropped
+        lengths = np.array([len(ring) for ring in rings])
+        ring_of_node = np.repeat(np.arange(len(rings)), lengths)
+        node_index, found = self._lookup(self.node_ids, np.concatenate(rings))
+        complete = np.bincount(ring_of_node[~found], minlength=len(rings)) == 0
+        keep = complete[ring_of_node]
+        _, indices = np.unique(ring_of_node[keep], return_inverse=True)
+        if len(indices) == 0:
+            return result
+        ring_geoms = shapely.linearrings(self.node_coords[node_index[keep]], indices=indices)
+        owners, inner = np.asarray(owners)[complete], np.asarray(inner)[complete]
+
+        shells, shell_owners = ring_geoms[~inner], owners[~inner]
+        holes, hole_owners = ring_geoms[inner], owners[inner]
+        shell_polygons = shapely.polygons(shells)
+
+        # Assign every inner ring to the smallest enclosing outer ring of the same relation
+        hole_parent = np.full(len(holes), -1)
+        if len(holes) and len(shells):
+            hole_index, shell_index = shapely.STRtree(shell_polygons).query(shapely.polygons(holes), predicate="within")
+            same = hole_owners[hole_index] == shell_owners[shell_index]
+            hole_index, shell_index = hole_index[same], shell_index[same]
+            order = np.lexsort((shapely.area(shell_polygons)[shell_index], hole_index))
+            hole_index, shell_index = hole_index[order], shell_index[order]
+            first = np.unique(hole_index, return_index=True)[1]
+            hole_parent[hole_index[first]] = shell_index[first]
+
+        holes_of = {}
+        for hole, parent in zip(holes, hole_parent):
+            if parent >= 0:
+                holes_of.setdefault(parent, []).append(hole)
+        parts = shell_polygons.copy()
+        for parent, parent_holes in holes_of.items():
+            parts[parent] = shapely.polygons(shells[parent], holes=parent_holes)
+
+        if len(parts):
+            targets, indices = np.unique(shell_owners, return_inverse=True)
+            result[targets] = shapely.multipolygons(parts, indices=indices)
+        return result
 
     def process_relations(self):
         """
-        Process OSM relations, combining way geometries into unified features.
+        Process OSM relations. Area relations (type=multipolygon/boundary) are assembled into
+        MultiPolygons from their outer/inner member rings; other relations (routes, ...) combine
+        their member way geometries.
         """
-        if self.df_relations.empty:
+        if not self.relations:
             return
 
-        for relation_id in self.df_relations.index:
-            members = self.df_relations.loc[relation_id, 'members']
-            member_geometries = []
-
-            for member in members:
-                if member['type'] == 'way' and member['ref'] not in self.processed_way_ids:
-                    way_geometry = self.get_way_geometry(member['ref'])
-                    member_geometries.append(way_geometry)
-
-                    # Mark the way and its nodes as processed
-                    self.processed_way_ids.add(member['ref'])
-                    self.processed_node_ids.update(self.df_ways.loc[member['ref'], 'nodes'])
-
-            if member_geometries:
-                combined_geom = unary_union(member_geometries) if len(member_geometries) > 1 else member_geometries[0]
-                self.processed_features.append({
-                    'feature_id': relation_id,
-                    'type': 'relation',
-                    'tags': self.df_relations.loc[relation_id, 'tags'],
-                    'geometry': combined_geom
-                })
+        features = []
+        area_relations, rings, owners, inner = [], [], [], []
+        for relation in self.relations:
+            way_members = [member for member in relation.get('members', []) if member['type'] == 'way']
+            if relation.get('tags', {}).get('type') not in ('multipolygon', 'boundary'):
+                geometry = self._combine_member_ways([member['ref'] for member in way_members])
+                if geometry is not None:
+                    features.append(self._relation_feature(relation, geometry))
+                continue
+
+            # Stitch rings separately per role, a shared way may belong to several relations
+            owner = len(area_relations)
+            area_relations.append(relation)
+            for is_inner in (False, True):
+                refs = [member['ref'] for member in way_members if (member.get('role') == 'inner') == is_inner]
+                way_index, found = self._lookup(self.way_ids, refs)
+                way_index = np.unique(way_index[found])
+                self._mark_ways_processed(way_index)
+                for ring in self.assemble_rings(way_index):
+                    rings.append(ring)
+                    owners.append(owner)
+                    inner.append(is_inner)
+
+        multipolygons = self.build_multipolygons(rings, np.array(owners, dtype=np.int64), np.array(inner, dtype=bool), len(area_relations))
+        for relation, geometry in zip(area_relations, multipolygons):
+            if geometry is None:
+                # Incomplete rings (e.g. members outside the query), keep the member geometries
+                geometry = self._combine_member_ways(
+                    [member['ref'] for member in relation.get('members', []) if member['type'] == 'way'],
+                    skip_processed=False
+                )
+            if geometry is not None:
+                features.append(self._relation_feature(relation, geometry))
+
+        if features:
+            self.processed_features.append(pd.DataFrame(features))
+
+    def _combine_member_ways(self, refs: List[int], skip_processed: bool = True):
+        """
+        Union of the member way geometries of a non-area relation, marking those ways processed.
+        """
+        way_index, found = self._lookup(self.way_ids, refs)
+        way_index = np.unique(way_index[found])
+        if skip_processed:
+            way_index = way_index[~self.way_done[way_index]]
+        if len(way_index) == 0:
+            return None
+
+        member_geometries = [g for g in self.build_way_geometries(way_index) if g is not None]
+        self._mark_ways_processed(way_index)
+        if not member_geometries:
+            return None
+        return unary_union(member_geometries) if len(member_geometries) > 1 else member_geometries[0]
+
+    def _relation_feature(self, relation: Dict, geometry) -> Dict:
+        """
+        Feature record of a processed relation.
+        """
+        return {
+            'feature_id': relation['id'],
+            'type': 'relation',
+            'tags': relation.get('tags', {}),
+            'geometry': geometry
+        }
 
     def process_ways(self):
         """
-        Process OSM ways that are not part of relations, creating geometries for each way.
+        Process OSM ways that are not part of relations, creating all geometries in bulk.
         """
-        if self.df_ways.empty:
+        way_index = np.flatnonzero(~self.way_done)
+        if len(way_index) == 0:
             return
 
-        for way_id in self.df_ways.index.difference(self.processed_way_ids):
-            way_geometry = self.get_way_geometry(way_id)
+        geometries = self.build_way_geometries(way_index)
+        self._mark_ways_processed(way_index)
 
-            # Mark the nodes of this way as processed
-            self.processed_node_ids.update(self.df_ways.loc[way_id, 'nodes'])
-
-            self.processed_features.append({
-                'feature_id': way_id,
-                'type': 'way',
-                'tags': self.df_ways.loc[way_id, 'tags'],
-                'geometry': way_geometry
-            })
+        valid = geometries != None  # noqa: E711, element-wise on an object array
+        self.processed_features.append(pd.DataFrame({
+            'feature_id': self.way_ids[way_index[valid]],
+            'type': 'way',
+            'tags': [self.way_tags[i] for i in way_index[valid]] if self.way_tags is not None else None,
+            'geometry': geometries[valid],
+        }))
 
     def process_nodes(self):
         """
         Process OSM nodes that are not part of ways or relations.
         """
-        if self.df_nodes.empty:
+        node_index = np.flatnonzero(~self.node_done)
+        if len(node_index) == 0:
             return
 
-        for node_id in self.df_nodes.index.difference(self.processed_node_ids):
-            self.processed_features.append({
-                'feature_id': node_id,
-                'type': 'node',
-                'tags': self.df_nodes.loc[node_id, 'tags'] if 'tags' in self.df_nodes.columns else {},
-                'geometry': Point(self.df_nodes.loc[node_id, ['lon', 'lat']])
-            })
+        self.processed_features.append(pd.DataFrame({
+            'feature_id': self.node_ids[node_index],
+            'type': 'node',
+            'tags': [self.node_tags[i] for i in node_index] if self.node_tags is not None else None,
+            'geometry': shapely.points(self.node_coords[node_index]),
+        }))
 
     def process_osm_data(self) -> gpd.GeoDataFrame:
         """
@@ -271,9 +1272,10 @@ class OSMProcessor:
         self.process_nodes()
 
         # Convert processed features to GeoDataFrame
-        if self.processed_features:
+        features = [df for df in self.processed_features if len(df) > 0]
+        if features:
             return gpd.GeoDataFrame(
-                self.processed_features,
+                pd.concat(features, ignore_index=True),
                 geometry="geometry",
                 crs="EPSG:4326"
             )
@@ -284,6 +1286,57 @@ class OSMProcessor:
                 crs="EPSG:4326"
             )
 
+def share_arrays(arrays: Dict[str, np.ndarray]) -> tuple:
+    """
+    Copy numpy arrays into a single shared memory block.
+
+    Args:
+        arrays (dict): Name -> np.ndarray.
+
+    Returns:
+        tuple: (SharedMemory, layout) where layout maps name -> (offset, dtype, shape).
+    """
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = (offset, array.dtype.str, array.shape)
+        offset += -(-array.nbytes // 8) * 8  # keep every array 8-byte aligned
+
+    shm = SharedMemory(create=True, size=max(offset, 1))
+    for name, array in arrays.items():
+        start, dtype, shape = layout[name]
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)[...] = array
+    return shm, layout
+
+
+def process_osm_arrays(arrays: Dict[str, np.ndarray]) -> tuple:
+    """
+    Build the geometries of one layer from compact arrays.
+
+    Returns:
+        tuple: (feature_ids, feature_types, wkb) as numpy arrays, types coded 0 node, 1 way, 2 relation.
+    """
+    df = OSMProcessor(arrays=arrays).process_osm_data()
+    feature_types = df['type'].map({'node': 0, 'way': 1, 'relation': 2}).to_numpy(dtype=np.int64)
+    return df['feature_id'].to_numpy(dtype=np.int64), feature_types, shapely.to_wkb(df.geometry.values)
+
+
+def process_shared_osm_arrays(name: str, layout: Dict) -> tuple:
+    """
+    Pool entry point: attach to a shared memory block written by `share_arrays` and process it.
+    """
+    shm = SharedMemory(name=name)
+    try:
+        arrays = {
+            key: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+            for key, (start, dtype, shape) in layout.items()
+        }
+        result = process_osm_arrays(arrays)
+        del arrays
+        return result
+    finally:
+        shm.close()
+
+
 if __name__ == '__main__':
     # Initialize DEMMiner with the service account JSON file
     miner = OSMMiner()
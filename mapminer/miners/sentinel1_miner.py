@@ -8,6 +8,8 @@ import xarray as xr
 import numpy as np
 import pandas as pd
 import rioxarray
+import dask.array as dsa
+from pyproj import Transformer
 from pystac_client import Client
 from shapely.geometry import Polygon, Point, box
 
@@ -30,6 +32,12 @@ class Sentinel1Miner:
             "collection": "sentinel-1-grd"
         },
     }
+    # calibrate= option -> calibration vector in calibration-iw-{pol}.xml
+    calibration_luts = {
+        "sigma0": "sigmaNought",
+        "gamma0": "gamma",
+        "db": "sigmaNought",
+    }
     def __init__(self,engine="planetary_computer"):
         """
         Initializes the Sentinel1GRDMiner class using the specified STAC engine.
@@ -46,7 +54,7 @@ class Sentinel1Miner:
                 os.environ["AWS_NO_SIGN_REQUEST"] = "YES"
             self.catalog = Client.open(self.catalog_url)
 
-    def fetch(self, lat=None, lon=None, radius=None, polygon=None, daterange="2024-01-01/2024-01-10", merge_nodata=False, orbit_state=None, relative_orbit=None):
+    def fetch(self, lat=None, lon=None, radius=None, polygon=None, daterange="2024-01-01/2024-01-10", merge_nodata=False, orbit_state=None, relative_orbit=None, calibrate=None):
         """
         Fetches Sentinel-1 GRD imagery for a given date range and bounding box or polygon.
 
@@ -59,6 +67,8 @@ class Sentinel1Miner:
         - merge_nodata (bool): Whether to merge nodata values from neighboring tiles (default: False).
         - orbit_state (str): Optional filter for orbit direction, e.g. 'ascending' or 'descending'.
         - relative_orbit (int): Optional filter for the relative orbit number, e.g. 156.
+        - calibrate (str): Optional per-pixel radiometric calibration, one of 'sigma0', 'gamma0' or 'db'
+          (sigma0 in decibels). Applied lazily, chunk by chunk (default: None, raw DN).
 
         Returns:
         - xarray.Dataset: Sentinel-1 GRD imagery with georeferencing and nodata merged if specified.
@@ -69,10 +79,10 @@ class Sentinel1Miner:
         # Determine the local UTM CRS based on the bounding box
         utm_crs = self._get_utm_crs(polygon.centroid.y, polygon.centroid.x)
 
-        ds_sentinel = self.fetch_imagery(daterange, polygon.bounds, utm_crs, merge_nodata, orbit_state, relative_orbit)
+        ds_sentinel = self.fetch_imagery(daterange, polygon.bounds, utm_crs, merge_nodata, orbit_state, relative_orbit, calibrate)
         return ds_sentinel
 
-    def fetch_imagery(self, daterange, bbox, crs, merge_nodata=False, orbit_state=None, relative_orbit=None):
+    def fetch_imagery(self, daterange, bbox, crs, merge_nodata=False, orbit_state=None, relative_orbit=None, calibrate=None):
         """
         Returns Dask Datacube of Sentinel-1 GRD based on the provided bounding box and date range (Lazy Loading).
 
@@ -83,10 +93,14 @@ class Sentinel1Miner:
         - merge_nodata (bool): Whether to merge nodata values from neighboring tiles (default: False).
         - orbit_state (str): Optional filter for orbit direction, e.g. 'ascending' or 'descending'.
         - relative_orbit (int): Optional filter for the relative orbit number, e.g. 156.
+        - calibrate (str): Optional per-pixel radiometric calibration, one of 'sigma0', 'gamma0' or 'db'.
 
         Returns:
         - xarray.Dataset: Sentinel-1 GRD dataset.
         """
+        if calibrate is not None and calibrate not in self.calibration_luts:
+            raise ValueError(f"calibrate must be one of {list(self.calibration_luts)} or None, got {calibrate!r}.")
+
         stac_query = {}
         if orbit_state is not None:
             stac_query["sat:orbit_state"] = {"eq": orbit_state.lower()}
@@ -120,44 +134,59 @@ class Sentinel1Miner:
             chunks={}
         ).astype("float32").sortby('time', ascending=True)
 
-        if merge_nodata:
-            ds_sentinel = self._merge_nodata(ds_sentinel)
-
-        # Attach per-day metadata (SAR properties + radiometric calibration) to attrs, grouped
-        # the same way as the pixel data so it lines up one-to-one with ds_sentinel.time
+        # Group items the same way as the pixel data so they line up one-to-one with ds_sentinel.time
         items_by_day = {}
         for item in query:
             day = pd.Timestamp(item.properties.get("datetime")).date()
             items_by_day.setdefault(day, []).append(item)
 
+        # Annotation XMLs are shared between calibration and metadata extraction
+        xml_cache = {}
+
+        # Calibrate before merging nodata, each time slice has to use its own scenes' LUTs
+        if calibrate is not None:
+            ds_sentinel = self._calibrate(ds_sentinel, items_by_day, calibrate, xml_cache)
+
+        if merge_nodata:
+            ds_sentinel = self._merge_nodata(ds_sentinel)
+
+        # Attach per-day metadata (SAR properties + radiometric calibration) to attrs
         metadata = []
         for t in pd.to_datetime(ds_sentinel.time.values):
-            scenes = [self._extract_metadata(item) for item in items_by_day.get(t.date(), [])]
+            scenes = [self._extract_metadata(item, xml_cache) for item in items_by_day.get(t.date(), [])]
             metadata.append(scenes[0] if len(scenes) == 1 else {"date": str(t.date()), "scenes": scenes})
 
         ds_sentinel.attrs['metadata'] = metadata
 
         return ds_sentinel
 
-    def _fetch_asset_bytes(self, href):
+    def _fetch_asset_bytes(self, href, cache=None):
         """
         Downloads the raw bytes of a STAC asset, transparently handling both
         signed HTTPS hrefs (Planetary Computer) and s3:// hrefs (Copernicus / element84).
 
         Parameters:
         - href (str): Asset href as returned by the STAC item.
+        - cache (dict): Optional href -> bytes dict, filled on download and reused on later calls.
 
         Returns:
         - bytes: Raw contents of the asset.
         """
+        if cache is not None and href in cache:
+            return cache[href]
+
         if href.startswith("s3://"):
             fs = s3fs.S3FileSystem(anon=True)
             with fs.open(href.replace("s3://", ""), "rb") as f:
-                return f.read()
+                content = f.read()
         else:
             response = requests.get(href, timeout=30)
             response.raise_for_status()
-            return response.content
+            content = response.content
+
+        if cache is not None:
+            cache[href] = content
+        return content
 
     def _parse_calibration_xml(self, xml_bytes):
         """
@@ -167,7 +196,7 @@ class Sentinel1Miner:
             sigma0 = (raw_data.astype(float) ** 2) / (K ** 2)
 
         K is the mean sigmaNought calibration constant for the scene (the full
-        per-pixel LUT in the XML is thousands of values and isn't kept here).
+        per-pixel LUT is applied by `fetch(calibrate=...)`, see `_parse_calibration_lut`).
 
         Parameters:
         - xml_bytes (bytes): Raw contents of the calibration XML file.
@@ -191,7 +220,203 @@ class Sentinel1Miner:
             "K_max": float(sigma_values.max()),
         }
 
-    def _extract_metadata(self, item):
+    def _parse_calibration_lut(self, xml_bytes, lut="sigmaNought"):
+        """
+        Parses the full calibration LUT of a `calibration-iw-{pol}.xml` annotation file.
+
+        Parameters:
+        - xml_bytes (bytes): Raw contents of the calibration XML file.
+        - lut (str): Calibration vector to read ('sigmaNought', 'betaNought', 'gamma' or 'dn').
+
+        Returns:
+        - dict: lines (n_lines,), pixels (n_pixels,) and values (n_lines, n_pixels) as float64 arrays.
+        """
+        root = ET.fromstring(xml_bytes)
+        vectors = root.findall(".//calibrationVectorList/calibrationVector")
+
+        lines = np.array([float(v.findtext("line")) for v in vectors], dtype="float64")
+        pixels = [np.array(v.findtext("pixel").split(), dtype="float64") for v in vectors]
+        values = [np.array(v.findtext(lut).split(), dtype="float64") for v in vectors]
+
+        # Vectors normally share pixel positions; resample onto the first one if they don't
+        grid = pixels[0]
+        values = np.stack([
+            vals if np.array_equal(pix, grid) else np.interp(grid, pix, vals)
+            for pix, vals in zip(pixels, values)
+        ])
+
+        order = np.argsort(lines)
+        return {"lines": lines[order], "pixels": grid, "values": values[order]}
+
+    def _parse_geolocation_grid(self, xml_bytes):
+        """
+        Parses the geolocation tie-point grid of a `product` annotation file (s1a-iw-grd-{pol}-*.xml).
+
+        Parameters:
+        - xml_bytes (bytes): Raw contents of the product annotation XML file.
+
+        Returns:
+        - dict: line, pixel, lat and lon of every tie point as float64 arrays.
+        """
+        root = ET.fromstring(xml_bytes)
+        points = root.findall(".//geolocationGrid/geolocationGridPointList/geolocationGridPoint")
+        return {
+            key: np.array([float(p.findtext(key)) for p in points], dtype="float64")
+            for key in ("line", "pixel", "latitude", "longitude")
+        }
+
+    def _poly_terms(self, x, y, degree=3):
+        """
+        Builds the 2D polynomial design terms [1, x, y, x^2, xy, y^2, ...] up to `degree`.
+        """
+        return np.stack([x ** (d - k) * y ** k for d in range(degree + 1) for k in range(d + 1)], axis=-1)
+
+    def _load_scene_calibration(self, item, pol, lut, crs, xml_cache=None):
+        """
+        Builds everything needed to calibrate one scene on the output grid: its calibration LUT
+        and a polynomial mapping from output-grid (x, y) to radar (line, pixel), fitted on the
+        annotation's geolocation tie points.
+
+        Parameters:
+        - item (pystac.Item): STAC item for a single Sentinel-1 scene.
+        - pol (str): Polarization, e.g. 'vv'.
+        - lut (str): Calibration vector name, e.g. 'sigmaNought'.
+        - crs (str): CRS of the output grid.
+        - xml_cache (dict): Optional href -> bytes cache.
+
+        Returns:
+        - dict | None: Scene calibration model, or None if the annotations are unavailable.
+        """
+        calibration_key, product_key = f"schema-calibration-{pol}", f"schema-product-{pol}"
+        if calibration_key not in item.assets or product_key not in item.assets:
+            return None
+
+        scene = self._parse_calibration_lut(self._fetch_asset_bytes(item.assets[calibration_key].href, xml_cache), lut)
+        grid = self._parse_geolocation_grid(self._fetch_asset_bytes(item.assets[product_key].href, xml_cache))
+
+        x, y = Transformer.from_crs("EPSG:4326", crs, always_xy=True).transform(grid["longitude"], grid["latitude"])
+
+        # Normalise coordinates so the cubic fit stays well conditioned
+        scene["x0"], scene["xs"] = x.mean(), x.std() or 1.0
+        scene["y0"], scene["ys"] = y.mean(), y.std() or 1.0
+        terms = self._poly_terms((x - scene["x0"]) / scene["xs"], (y - scene["y0"]) / scene["ys"])
+        coeffs, *_ = np.linalg.lstsq(terms, np.stack([grid["line"], grid["pixel"]], axis=-1), rcond=None)
+        scene["coeffs"] = coeffs
+        return scene
+
+    def _interp_lut(self, scene, line, pixel):
+        """
+        Bilinearly interpolates a scene's calibration LUT at (line, pixel) positions.
+        """
+        lines, pixels, values = scene["lines"], scene["pixels"], scene["values"]
+
+        i = np.clip(np.searchsorted(lines, line, side="right") - 1, 0, len(lines) - 2)
+        j = np.clip(np.searchsorted(pixels, pixel, side="right") - 1, 0, len(pixels) - 2)
+        t = np.clip((line - lines[i]) / (lines[i + 1] - lines[i]), 0, 1)
+        u = np.clip((pixel - pixels[j]) / (pixels[j + 1] - pixels[j]), 0, 1)
+
+        return (
+            (1 - t) * (1 - u) * values[i, j] + (1 - t) * u * values[i, j + 1]
+            + t * (1 - u) * values[i + 1, j] + t * u * values[i + 1, j + 1]
+        )
+
+    def _calibrate_block(self, dn, ys, xs, scenes, nodata=None, db=False, block_info=None):
+        """
+        Calibrates one (y, x) block of DN values: the LUT is interpolated for the block's pixels
+        only and immediately combined with the DN, so no full-size LUT ever exists.
+
+            sigma0 = DN ** 2 / K(line, pixel) ** 2
+
+        Parameters:
+        - dn (np.ndarray): DN block.
+        - ys, xs (np.ndarray): Full y / x coordinates of the time slice.
+        - scenes (list): Scene calibration models (see `_load_scene_calibration`).
+        - nodata (float): DN nodata value, mapped to NaN.
+        - db (bool): Whether to return 10 * log10(sigma0).
+        - block_info (dict): Provided by dask.array.map_blocks.
+
+        Returns:
+        - np.ndarray: Calibrated float32 block.
+        """
+        if block_info is None or dn.size == 0:
+            return np.empty(dn.shape, dtype="float32")
+
+        (y0, y1), (x0, x1) = block_info[0]["array-location"]
+        x, y = np.meshgrid(xs[x0:x1], ys[y0:y1])
+
+        # First scene covering a pixel wins, matching odc.stac's mosaic order
+        K = np.full(dn.shape, np.nan, dtype="float64")
+        for scene in scenes:
+            terms = self._poly_terms((x - scene["x0"]) / scene["xs"], (y - scene["y0"]) / scene["ys"])
+            line, pixel = np.moveaxis(terms @ scene["coeffs"], -1, 0)
+            inside = (
+                np.isnan(K)
+                & (line >= scene["lines"][0]) & (line <= scene["lines"][-1])
+                & (pixel >= scene["pixels"][0]) & (pixel <= scene["pixels"][-1])
+            )
+            K[inside] = self._interp_lut(scene, line[inside], pixel[inside])
+
+        dn = dn.astype("float64")
+        if nodata is not None and not np.isnan(nodata):
+            dn[dn == nodata] = np.nan
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            calibrated = dn ** 2 / K ** 2
+            if db:
+                calibrated = np.where(calibrated > 0, 10 * np.log10(calibrated), np.nan)
+
+        return calibrated.astype("float32")
+
+    def _calibrate(self, ds_sentinel, items_by_day, calibrate, xml_cache=None):
+        """
+        Applies per-pixel radiometric calibration (DN -> sigma0 / gamma0 / dB) to every
+        polarization band of the cube as a lazy, block-wise dask stage.
+
+        Parameters:
+        - ds_sentinel (xarray.Dataset): Raw DN cube as returned by odc.stac.load.
+        - items_by_day (dict): STAC items grouped by acquisition date.
+        - calibrate (str): 'sigma0', 'gamma0' or 'db'.
+        - xml_cache (dict): Optional href -> bytes cache shared with metadata extraction.
+
+        Returns:
+        - xarray.Dataset: Calibrated float32 dataset with nodata as NaN.
+        """
+        lut = self.calibration_luts[calibrate]
+        crs = ds_sentinel.rio.crs
+        times = pd.to_datetime(ds_sentinel.time.values)
+        ys, xs = ds_sentinel.y.values, ds_sentinel.x.values
+
+        for band in list(ds_sentinel.data_vars):
+            slices = []
+            for index, t in enumerate(times):
+                scenes = [
+                    self._load_scene_calibration(item, band, lut, crs, xml_cache)
+                    for item in items_by_day.get(t.date(), [])
+                ]
+                scenes = [scene for scene in scenes if scene is not None]
+                if not scenes:
+                    raise ValueError(f"No calibration annotations available for band {band!r} on {t.date()}.")
+
+                da = ds_sentinel[band].isel(time=index)
+                data = dsa.map_blocks(
+                    self._calibrate_block,
+                    dsa.asarray(da.data),
+                    ys=ys,
+                    xs=xs,
+                    scenes=scenes,
+                    nodata=da.attrs.get("nodata"),
+                    db=calibrate == "db",
+                    dtype="float32",
+                )
+                slices.append(da.copy(data=data))
+
+            attrs = {k: v for k, v in ds_sentinel[band].attrs.items() if k != "nodata"}
+            attrs.update({"calibration": calibrate, "units": "dB" if calibrate == "db" else "linear"})
+            ds_sentinel[band] = xr.concat(slices, dim="time").assign_attrs(attrs)
+
+        return ds_sentinel
+
+    def _extract_metadata(self, item, xml_cache=None):
         """
         Builds a metadata dictionary for a single Sentinel-1 STAC item, combining
         its SAR/orbit properties with the per-polarization calibration LUTs
@@ -200,6 +425,7 @@ class Sentinel1Miner:
 
         Parameters:
         - item (pystac.Item): STAC item for a single Sentinel-1 scene.
+        - xml_cache (dict): Optional href -> bytes cache of already downloaded annotations.
 
         Returns:
         - dict: Scene properties plus a 'calibration' entry keyed by polarization.
@@ -213,7 +439,7 @@ class Sentinel1Miner:
             if asset_key not in item.assets:
                 continue
             try:
-                xml_bytes = self._fetch_asset_bytes(item.assets[asset_key].href)
+                xml_bytes = self._fetch_asset_bytes(item.assets[asset_key].href, xml_cache)
                 calibration[pol] = self._parse_calibration_xml(xml_bytes)
             except Exception as e:
                 calibration[pol] = {"error": str(e)}
@@ -0,0 +1,3 @@
+from .zorder import morton_key
+
+__all__ = ["morton_key"]
@@ -0,0 +1,27 @@
+import numpy as np
+
+
+def morton_key(lon: np.ndarray, lat: np.ndarray, bounds: tuple = (-180, -90, 180, 90)) -> np.ndarray:
+    """
+    Z-order (Morton) key of lon/lat positions on a 2^16 x 2^16 grid over bounds.
+
+    Args:
+        lon (np.ndarray): Longitudes.
+        lat (np.ndarray): Latitudes.
+        bounds (tuple): (minx, miny, maxx, maxy) covered by the grid, the whole globe by default.
+
+    Returns:
+        np.ndarray: uint64 keys; sorting by them keeps nearby positions together.
+    """
+    def spread(v):
+        v = v.astype(np.uint64)
+        v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF)
+        v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+        v = (v | (v << np.uint64(2))) & np.uint64(0x33333333)
+        v = (v | (v << np.uint64(1))) & np.uint64(0x55555555)
+        return v
+
+    min_x, min_y, max_x, max_y = bounds
+    x = np.clip((np.asarray(lon) - min_x) / (max_x - min_x) * 65535, 0, 65535)
+    y = np.clip((np.asarray(lat) - min_y) / (max_y - min_y) * 65535, 0, 65535)
+    return spread(x) | (spread(y) << np.uint64(1))
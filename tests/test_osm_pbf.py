@@ -0,0 +1,37 @@
+import pytest
+from shapely.geometry import box
+
+osmium = pytest.importorskip("osmium")
+
+from mapminer.miners.osm_miner import OSMMiner
+
+
+@pytest.fixture
+def pbf_path(tmp_path):
+    """
+    Tiny extract with a forest multipolygon whose outer ring passes through lon/lat 10 and whose
+    inner ring is a highway=primary way around lon/lat 20.
+    """
+    path = str(tmp_path / "extract.osm.pbf")
+    locations = {
+        1: (10.0, 10.0), 2: (10.0, 30.0), 3: (30.0, 30.0), 4: (30.0, 10.0),
+        5: (20.0, 20.0), 6: (20.1, 20.0), 7: (20.1, 20.1), 8: (20.0, 20.1),
+    }
+    writer = osmium.SimpleWriter(path)
+    for node_id, location in locations.items():
+        writer.add_node(osmium.osm.mutable.Node(id=node_id, location=location, tags={}))
+    writer.add_way(osmium.osm.mutable.Way(id=10, nodes=[1, 2, 3, 4, 1], tags={}))
+    writer.add_way(osmium.osm.mutable.Way(id=11, nodes=[5, 6, 7, 8, 5], tags={'highway': 'primary'}))
+    writer.add_relation(osmium.osm.mutable.Relation(
+        id=100, members=[('w', 10, 'outer'), ('w', 11, 'inner')], tags={'type': 'multipolygon', 'landuse': 'forest'}
+    ))
+    writer.close()
+    return path
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_relation_member_way_outside_aoi_is_not_returned(pbf_path, tmp_path, indexed):
+    miner = OSMMiner(engine="pbf", pbf_path=pbf_path, index_dir=str(tmp_path / "index") if indexed else None, workers=1)
+    gdf = miner.fetch(polygon=box(9.9, 9.9, 10.1, 10.1))
+    assert 'state_highway' not in set(gdf['layer_name'])
+    assert gdf.geometry.intersects(box(9.9, 9.9, 10.1, 10.1)).all()